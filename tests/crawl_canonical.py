@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+"""
+Crawl which starts from a non-canonical product URL, with responses
+served by a downloader middleware instead of the website. Run by
+test_canonical.py in a separate process, since a process can install
+only one reactor.
+
+    python tests/crawl_canonical.py <start url>
+"""
+
+import json
+import sys
+
+import scrapy
+from scrapy.crawler import CrawlerProcess
+from scrapy.http import HtmlResponse
+
+
+class FakeWebsiteMiddleware(object):
+    """ Answers every request with an empty page """
+    def process_request(self, request, spider):
+        return HtmlResponse(request.url, body=b'<html></html>', request=request)
+
+
+class StartUrlSpider(scrapy.Spider):
+    name = 'canonical_test'
+
+    def parse(self, response):
+        yield {'url': response.url}
+
+
+def main(start_url):
+    process = CrawlerProcess({
+        'SPIDER_MIDDLEWARES': {
+            'wildsearch_crawler.middlewares.CanonicalUrlMiddleware': 550,
+        },
+        'DOWNLOADER_MIDDLEWARES': {
+            '__main__.FakeWebsiteMiddleware': 1,
+        },
+        'LOG_LEVEL': 'WARNING',
+    })
+    crawler = process.create_crawler(StartUrlSpider)
+    items = []
+    crawler.signals.connect(lambda item: items.append(item), signal=scrapy.signals.item_scraped, weak=False)
+    process.crawl(crawler, start_urls=[start_url])
+    process.start()
+
+    print(json.dumps({
+        'items': items,
+        'refetch_avoided': crawler.stats.get_value('canonical_url/refetch_avoided', 0),
+    }))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+"""
+Crawl with project settings and a callback which awaits a cpu_bound
+function, run by test_offload.py in a separate process, since a process
+can install only one reactor.
+
+    python tests/crawl_offload.py [--pool]
+"""
+
+import json
+import sys
+
+import scrapy
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+# spiders import offload before the crawler installs the reactor,
+# the same way as scrapy crawl loads them
+import wildsearch_crawler.spiders.ozon_spider  # noqa: F401
+import wildsearch_crawler.spiders.productcenter_spider  # noqa: F401
+import wildsearch_crawler.spiders.wildberries_spider  # noqa: F401
+from wildsearch_crawler.offload import cpu_bound
+
+
+@cpu_bound
+def count_words(text):
+    return len(text.split())
+
+
+class OffloadSpider(scrapy.Spider):
+    name = 'offload_test'
+    start_urls = ['data:text/plain,one%20two%20three']
+
+    async def parse(self, response):
+        yield {'words': await count_words(response.text)}
+
+
+def main(pool):
+    settings = get_project_settings()
+    settings.set('PROCESS_POOL_ENABLED', pool)
+    settings.set('LOG_LEVEL', 'WARNING')
+
+    items = []
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(OffloadSpider)
+    crawler.signals.connect(lambda item: items.append(item), signal=scrapy.signals.item_scraped, weak=False)
+    process.crawl(crawler)
+    process.start()
+
+    print(json.dumps({'items': items, 'stats': {
+        'finish_reason': crawler.stats.get_value('finish_reason'),
+        'errors': crawler.stats.get_value('log_count/ERROR', 0),
+    }}))
+
+
+if __name__ == '__main__':
+    main('--pool' in sys.argv)
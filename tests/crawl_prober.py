@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+Crawl which only runs ProxyProber of RotatingProxyMiddleware, through
+the real downloader, until all proxies are checked. Run by
+test_prober.py in a separate process, since a process can install only
+one reactor.
+
+    python tests/crawl_prober.py <probe url> <proxy> [<proxy> ...]
+"""
+
+import json
+import sys
+
+import scrapy
+from scrapy.crawler import CrawlerProcess
+from scrapy.exceptions import DontCloseSpider
+
+from wildsearch_crawler.middlewares import RotatingProxyMiddleware
+
+
+class ProbeSpider(scrapy.Spider):
+    name = 'probe_test'
+    start_urls = []
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=scrapy.signals.spider_idle)
+        return spider
+
+    def get_proxy_middleware(self):
+        for middleware in self.crawler.engine.downloader.middleware.middlewares:
+            if isinstance(middleware, RotatingProxyMiddleware):
+                return middleware
+
+    def spider_idle(self, spider):
+        if self.get_proxy_middleware().get_pool('').unchecked:
+            raise DontCloseSpider()
+
+
+def main(probe_url, proxies):
+    process = CrawlerProcess({
+        'DOWNLOADER_MIDDLEWARES': {
+            'wildsearch_crawler.middlewares.RotatingProxyMiddleware': 610,
+            'wildsearch_crawler.middlewares.BanDetectionMiddleware': 620,
+        },
+        'ROTATING_PROXY_LIST': ','.join(proxies),
+        'ROTATING_PROXY_PROBE_URL': probe_url,
+        'ROTATING_PROXY_PROBE_INTERVAL': 0.1,
+        'ROTATING_PROXY_PROBE_TIMEOUT': 5,
+        # dead proxies must not be reanimated and probed again during the
+        # run; with full jitter the backoff is uniform(0, cap), and a
+        # backoff under CLOSESPIDER_TIMEOUT has a chance of about 1e-11
+        'ROTATING_PROXY_BACKOFF_BASE': 10 ** 12,
+        'ROTATING_PROXY_BACKOFF_CAP': 10 ** 12,
+        'ROTATING_PROXY_LOGSTATS_INTERVAL': 0,
+        'CLOSESPIDER_TIMEOUT': 30,
+        'LOG_LEVEL': 'WARNING',
+    })
+    crawler = process.create_crawler(ProbeSpider)
+    result = {}
+
+    def spider_closed(spider, reason):
+        pool = spider.get_proxy_middleware().get_pool('')
+        result.update(reason=reason, good=sorted(pool.good), dead=sorted(pool.dead),
+                      probe_good=crawler.stats.get_value('proxies/probe/good', 0),
+                      probe_dead=crawler.stats.get_value('proxies/probe/dead', 0))
+
+    crawler.signals.connect(spider_closed, signal=scrapy.signals.spider_closed, weak=False)
+    process.crawl(crawler)
+    process.start()
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], sys.argv[2:])
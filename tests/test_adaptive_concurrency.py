@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+from wildsearch_crawler.middlewares import AdaptiveConcurrencyMiddleware
+
+
+def make_middleware(slot):
+    crawler = get_crawler(settings_dict={'ADAPTIVE_CONCURRENCY_ENABLED': True, 'ADAPTIVE_CONCURRENCY_WINDOW': 2})
+    crawler.engine = SimpleNamespace(downloader=SimpleNamespace(slots={'proxy': slot}))
+    return AdaptiveConcurrencyMiddleware.from_crawler(crawler)
+
+
+def send_window(middleware, ban):
+    for _ in range(2):
+        middleware._handle_result(Request('https://www.ozon.ru/', meta={'_ban': ban, 'download_slot': 'proxy'}))
+
+
+def test_delay_is_used_only_at_concurrency_one():
+    slot = SimpleNamespace(concurrency=4, delay=0)
+    middleware = make_middleware(slot)
+
+    send_window(middleware, True)
+    assert (slot.concurrency, slot.delay) == (2, 0)
+    send_window(middleware, True)
+    send_window(middleware, True)
+    assert (slot.concurrency, slot.delay) == (1, 1.0)
+
+    # the delay goes away before concurrency grows again
+    while slot.delay:
+        send_window(middleware, False)
+        assert slot.concurrency == 1
+    send_window(middleware, False)
+    assert (slot.concurrency, slot.delay) == (2, 0)
+
+
+def test_probes_are_not_counted():
+    slot = SimpleNamespace(concurrency=4, delay=0)
+    middleware = make_middleware(slot)
+
+    for _ in range(4):
+        middleware._handle_result(Request('https://www.ozon.ru/', meta={
+            '_ban': True, 'download_slot': 'proxy', '_rotating_proxy_probe': True,
+        }))
+    assert slot.concurrency == 4
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_start_requests_are_canonicalized():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'tests', 'crawl_canonical.py'),
+         'https://wildberries.ru/catalog/8685970/detail.aspx?targetUrl=GP'],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120,
+    )
+
+    assert result.returncode == 0, result.stderr
+    output = json.loads(result.stdout.strip().splitlines()[-1])
+    assert output == {
+        'items': [{'url': 'https://www.wildberries.ru/catalog/8685970/detail.aspx'}],
+        'refetch_avoided': 1,
+    }, result.stderr
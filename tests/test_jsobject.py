@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import dukpy
+import pytest
+
+from wildsearch_crawler.jsobject import eval_js_object, parse_js_object
+
+
+@pytest.mark.parametrize('text', [
+    "{a: 1, 'b': [true, null,], c: \"d\"}",
+    "{price: NaN, max: Infinity, min: -Infinity}",
+    "{values: [NaN, 1.5, -Infinity]}",
+    "{a: [ , ]}",
+    "{a: [1, , 2]}",
+    "{a: [, , 3, ,]}",
+    "{a: [[,], {b: [,1]}]}",
+    "{a: ',,', b: '[ , ]'}",
+    "{a: .5, b: 5., c: 'x\\u0079z'}",
+])
+def test_same_as_dukpy(text):
+    assert parse_js_object(text) == dukpy.evaljs(f'init={text};init;')
+
+
+def test_eval_path():
+    text = "{router: {ssrModel: {selectedNomenclature: {ordersCount: 7, rating: NaN}}}}"
+    assert eval_js_object(text, 'router.ssrModel.selectedNomenclature') == {'ordersCount': 7, 'rating': None}
+
+
+@pytest.mark.parametrize('text', [
+    "{a: b}",
+    "{a: f(1)}",
+    "{, a: 1}",
+])
+def test_not_plain_data(text):
+    with pytest.raises(ValueError):
+        parse_js_object(text)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('args', [[], ['--pool']])
+def test_crawl_with_default_reactor(args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop('SCRAPY_SETTINGS_MODULE', None)
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'tests', 'crawl_offload.py')] + args,
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert 'does not match the requested one' not in result.stderr
+    output = json.loads(result.stdout.strip().splitlines()[-1])
+    assert output['items'] == [{'words': 3}]
+    assert output['stats'] == {'finish_reason': 'finished', 'errors': 0}
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import pytest
+from scrapy.http import HtmlResponse, Request
+
+from wildsearch_crawler.policy import ContentBanDetectionPolicy
+
+
+def response(url, body):
+    return HtmlResponse(url, body=body, encoding='utf8', request=Request(url))
+
+
+def find_marker(markers, url, body, scan_bytes=4 * 1024):
+    policy = ContentBanDetectionPolicy(markers, scan_bytes=scan_bytes)
+    resp = response(url, body)
+    return policy.find_marker(resp.request, resp)
+
+
+def test_literal_marker():
+    markers = {'wildberries.ru': {'captcha': 'captcha'}}
+    assert find_marker(markers, 'https://www.wildberries.ru/', b'<div class="captcha">') == 'captcha'
+    assert find_marker(markers, 'https://www.wildberries.ru/', b'<div class="catalog">') is None
+    assert find_marker(markers, 'https://www.ozon.ru/', b'<div class="captcha">') is None
+
+
+def test_marker_outside_scan_window():
+    markers = {'*': {'captcha': 'captcha'}}
+    assert find_marker(markers, 'https://example.com/', b' ' * 100 + b'captcha', scan_bytes=64) is None
+
+
+def test_regex_markers_with_anchors_and_groups():
+    markers = {'*': {
+        'stub': r'^<html><body>\s*$',
+        'antibot': r'(?<=id=")(anti)(bot)',
+        'captcha': 'captcha',
+    }}
+    assert find_marker(markers, 'https://example.com/', b'<html><body>  ') == 'stub'
+    assert find_marker(markers, 'https://example.com/', b'<div id="antibot">') == 'antibot'
+    assert find_marker(markers, 'https://example.com/', b'<div id="x">antibot</div>') is None
+
+
+def test_more_specific_domain_overrides_parent():
+    markers = {
+        'wildberries.ru': {'captcha': 'captcha'},
+        'www.wildberries.ru': {'captcha': 'robot check'},
+    }
+    assert find_marker(markers, 'https://www.wildberries.ru/', b'captcha') is None
+    assert find_marker(markers, 'https://www.wildberries.ru/', b'robot check') == 'captcha'
+
+
+def test_markers_which_cannot_be_joined():
+    markers = {'*': {
+        'captcha': 'captcha',
+        'repeat': r'<(b|i)>blocked</\1>',
+        'denied': r'(?i)access denied',
+        'stub': r'^<html><body>\s*$',
+    }}
+    assert find_marker(markers, 'https://example.com/', b'<i>blocked</i>') == 'repeat'
+    assert find_marker(markers, 'https://example.com/', b'<i>blocked</b>') is None
+    assert find_marker(markers, 'https://example.com/', b'ACCESS DENIED') == 'denied'
+    assert find_marker(markers, 'https://example.com/', b'<div>captcha</div>') == 'captcha'
+    assert find_marker(markers, 'https://example.com/', b'<html><body>  ') == 'stub'
+
+
+def test_bad_marker():
+    with pytest.raises(ValueError, match="'broken'"):
+        find_marker({'*': {'broken': r'captcha('}}, 'https://example.com/', b'captcha')
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import csv
+import glob
+import os
+
+from wildsearch_crawler.positions import PositionsStore
+
+CATEGORY_URL = 'https://www.wildberries.ru/catalog/zhenshchinam/odezhda/vodolazki'
+OTHER_CATEGORY_URL = 'https://www.wildberries.ru/catalog/muzhchinam/odezhda/bryuki'
+
+
+def run(path, positions, _time, complete=(CATEGORY_URL,)):
+    store = PositionsStore(path)
+    for category_url, sku, position in positions:
+        store.add(category_url, sku, position)
+    for category_url in complete:
+        store.complete(category_url)
+    return store.commit(_time=_time)
+
+
+def read_changes(path):
+    filename, = glob.glob(os.path.join(path, 'changes-*.csv'))
+    with open(filename, encoding='utf8') as f:
+        rows = list(csv.DictReader(f))
+    os.remove(filename)
+    return [(r['wb_id'], r['old_position'], r['wb_category_position']) for r in rows]
+
+
+def test_removed_product_comes_back_as_new(tmpdir):
+    path = str(tmpdir)
+
+    assert run(path, [(CATEGORY_URL, 1, 1), (CATEGORY_URL, 2, 2), (CATEGORY_URL, 3, 3)], 0) == {
+        'changed': 0, 'new': 3, 'removed': 0,
+    }
+    read_changes(path)
+
+    assert run(path, [(CATEGORY_URL, 1, 1), (CATEGORY_URL, 3, 2)], 1) == {'changed': 1, 'new': 0, 'removed': 1}
+    assert read_changes(path) == [('2', '2', ''), ('3', '3', '2')]
+
+    # a removed product isn't reported again and comes back as new
+    assert run(path, [(CATEGORY_URL, 1, 1), (CATEGORY_URL, 3, 2), (CATEGORY_URL, 2, 5)], 2) == {
+        'changed': 0, 'new': 1, 'removed': 0,
+    }
+    assert read_changes(path) == [('2', '', '5')]
+
+
+def test_incomplete_categories_keep_positions(tmpdir):
+    path = str(tmpdir)
+    run(path, [(CATEGORY_URL, 1, 1), (OTHER_CATEGORY_URL, 7, 1), (OTHER_CATEGORY_URL, 8, 2)], 0,
+        complete=(CATEGORY_URL, OTHER_CATEGORY_URL))
+
+    # the other category isn't crawled to the end, its products aren't removed
+    assert run(path, [(CATEGORY_URL, 1, 2), (OTHER_CATEGORY_URL, 8, 1)], 1) == {'changed': 2, 'new': 0, 'removed': 0}
+
+    categories, skus, positions = PositionsStore(path).load_snapshot()
+    assert sorted(zip(skus, positions)) == [(1, 2), (7, 1), (8, 1)]
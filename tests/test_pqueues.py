@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+import scrapy
+from scrapy.utils.test import get_crawler
+
+from wildsearch_crawler.pqueues import CheckpointPriorityQueue
+from wildsearch_crawler.squeues import PickleLifoSQLiteQueue
+
+
+class QueueSpider(scrapy.Spider):
+    name = 'queue_test'
+
+    def parse_item(self, response):
+        pass
+
+
+def make_queue(crawler, key, startprios=()):
+    return CheckpointPriorityQueue.from_crawler(crawler, PickleLifoSQLiteQueue, key, startprios)
+
+
+def test_queues_are_found_after_crash(tmp_path):
+    crawler = get_crawler(QueueSpider)
+    crawler.spider = QueueSpider()
+    key = str(tmp_path / 'requests.queue')
+
+    queue = make_queue(crawler, key)
+    queue.push(scrapy.Request('https://example.com/1'))
+    # a queue of a new priority, created after the last active.json was written
+    queue.push(scrapy.Request('https://example.com/2', priority=5, callback=crawler.spider.parse_item,
+                              meta={'good': {'wb_id': '1'}}))
+    # no close(), the process crashed
+
+    resumed = make_queue(crawler, key)
+    assert len(resumed) == 2
+    request = resumed.pop()
+    assert request.url == 'https://example.com/2'
+    assert request.callback == crawler.spider.parse_item
+    assert request.meta['good'] == {'wb_id': '1'}
+    assert resumed.pop().url == 'https://example.com/1'
+    assert resumed.pop() is None
+
+
+def test_unserializable_request_raises_value_error(tmp_path):
+    crawler = get_crawler(QueueSpider)
+    crawler.spider = QueueSpider()
+    queue = PickleLifoSQLiteQueue.from_crawler(crawler, str(tmp_path / 'requests.queue' / '0'))
+
+    with pytest.raises(ValueError):
+        queue.push(scrapy.Request('https://example.com/', meta={'lock': threading.Lock()}))
+    assert len(queue) == 0
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from wildsearch_crawler.expire import Proxies
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_proxy_handler(status):
+    class ProxyHandler(BaseHTTPRequestHandler):
+        """ Forward proxy stand-in which answers every request itself """
+        def do_GET(self):
+            body = b'ok'
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return ProxyHandler
+
+
+@pytest.fixture
+def proxy_server():
+    servers = []
+
+    def start(status):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), make_proxy_handler(status))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return 'http://127.0.0.1:%d' % server.server_address[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return 'http://127.0.0.1:%d' % sock.getsockname()[1]
+
+
+def test_prober_checks_proxies_through_downloader(proxy_server):
+    good = proxy_server(200)
+    banned = proxy_server(403)
+    refused = closed_port()
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'tests', 'crawl_prober.py'),
+         'http://example.com/probe', good, banned, refused],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120,
+    )
+
+    assert result.returncode == 0, result.stderr
+    output = json.loads(result.stdout.strip().splitlines()[-1])
+    assert output == {
+        'reason': 'finished',
+        'good': [good],
+        'dead': sorted([banned, refused]),
+        'probe_good': 1,
+        'probe_dead': 2,
+    }, result.stderr
+
+
+def test_prefer_good_uses_unchecked_proxies_only_without_good_ones():
+    proxies = Proxies(['http://a:1', 'http://b:1', 'http://c:1'], prefer_good=True)
+    assert sorted(proxies.available) == ['http://a:1', 'http://b:1', 'http://c:1']
+
+    proxies.mark_good('http://b:1')
+    assert [proxies.get_random() for _ in range(20)] == ['http://b:1'] * 20
+
+    # unchecked proxies are used again once the good one dies
+    proxies.mark_dead('http://b:1')
+    assert sorted(proxies.available) == ['http://a:1', 'http://c:1']
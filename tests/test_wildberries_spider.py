@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import scrapy
+from scrapy.http import TextResponse
+from scrapy.utils.test import get_crawler
+
+from wildsearch_crawler.spiders.wildberries_spider import WildberriesSpider
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+CATEGORY_URL = 'https://www.wildberries.ru/catalog/zhenshchinam/odezhda/vodolazki'
+CATEGORY_QUERY = 'kind=2&subject=151'
+
+
+def make_spider(settings=None, **kwargs):
+    crawler = get_crawler(WildberriesSpider, settings)
+    return WildberriesSpider.from_crawler(crawler, **kwargs)
+
+
+def fixture_response(request, name):
+    with open(os.path.join(DATA_DIR, name), 'rb') as f:
+        return TextResponse(request.url, body=f.read(), encoding='utf8', request=request)
+
+
+def category_page_request(spider, page=1):
+    return spider.category_page_request(CATEGORY_URL, 'Водолазки', CATEGORY_QUERY, page)
+
+
+def split_output(output):
+    requests = [r for r in output if isinstance(r, scrapy.Request)]
+    items = [i for i in output if not isinstance(i, scrapy.Request)]
+    return items, requests
+
+
+def test_catalog_page_items():
+    spider = make_spider(skip_details='true')
+    request = category_page_request(spider, page=2)
+    items, requests = split_output(list(spider.parse_category_page_json(fixture_response(request, 'wb_catalog_page.json'))))
+
+    assert [(i['wb_id'], i['wb_category_position']) for i in items] == [(8685970, 101), (12051428, 102), (14783266, 103)]
+    item = items[0]
+    assert item['product_name'] == 'Водолазка'
+    assert item['wb_brand_name'] == 'befree'
+    assert item['wb_price'] == 979
+    assert item['wb_reviews_count'] == 1204
+    assert item['product_url'] == 'https://www.wildberries.ru/catalog/8685970/detail.aspx'
+    assert item['wb_category_url'] == CATEGORY_URL
+    assert item['wb_category_name'] == 'Водолазки'
+    # the walk goes on past a page with products
+    assert [r.url for r in requests] == [WildberriesSpider.CATEGORY_API_URL + CATEGORY_QUERY + '&page=5']
+
+
+def test_empty_catalog_page_ends_walk():
+    spider = make_spider(skip_details='true')
+    request = category_page_request(spider, page=4)
+
+    assert list(spider.parse_category_page_json(fixture_response(request, 'wb_catalog_empty_page.json'))) == []
+    assert spider.crawler.stats.get_value('category_walk/empty_pages') == 1
+
+
+def test_detail_api_items():
+    spider = make_spider(detail_api='true')
+    request = category_page_request(spider)
+    items, requests = split_output(list(spider.parse_category_page_json(fixture_response(request, 'wb_catalog_page.json'))))
+
+    assert items == []
+    detail_request = requests[0]
+    assert detail_request.url == WildberriesSpider.DETAIL_API_URL + '8685970;12051428;14783266'
+    assert detail_request.meta['positions'] == {8685970: 1, 12051428: 2, 14783266: 3}
+
+    items = list(spider.parse_detail_api(fixture_response(detail_request, 'wb_detail_api.json')))
+
+    assert [dict(i) for i in items] == [
+        {
+            'wb_id': '8685970',
+            'product_name': 'Водолазка',
+            'wb_brand_name': 'befree',
+            'parse_date': items[0]['parse_date'],
+            'marketplace': 'wildberries',
+            'product_url': 'https://www.wildberries.ru/catalog/8685970/detail.aspx',
+            'wb_category_url': CATEGORY_URL,
+            'wb_category_name': 'Водолазки',
+            'wb_category_position': 1,
+            'wb_price': '979',
+            'wb_reviews_count': '1205',
+            'wb_rating': '5',
+            'image_urls': [
+                'https://images.wbstatic.net/big/new/8680000/8685970-1.jpg',
+                'https://images.wbstatic.net/big/new/8680000/8685970-2.jpg',
+            ],
+        },
+        {
+            'wb_id': '12051428',
+            'product_name': 'Водолазка базовая',
+            'wb_brand_name': "O'STIN",
+            'parse_date': items[1]['parse_date'],
+            'marketplace': 'wildberries',
+            'product_url': 'https://www.wildberries.ru/catalog/12051428/detail.aspx',
+            'wb_category_url': CATEGORY_URL,
+            'wb_category_name': 'Водолазки',
+            'wb_category_position': 2,
+            'wb_price': '799.50',
+            'wb_reviews_count': '87',
+            'wb_rating': '4',
+        },
+    ]
+    # card API didn't return the third product
+    assert spider.crawler.stats.get_value('detail_api/missing') == 1
+
+
+def test_detail_api_prices():
+    spider = make_spider(detail_api='true')
+    detail_request = spider.detail_api_request({15093820: 1, 17442051: 2, 17442052: 3}, CATEGORY_URL, 'Холодильники')
+
+    items = list(spider.parse_detail_api(fixture_response(detail_request, 'wb_detail_api_prices.json')))
+
+    # kopecks are kept exactly, however many digits the price has
+    assert [i['wb_price'] for i in items] == ['1299999', '12999.99', '24999.50']
+
+
+def test_search_queries_from_file(tmpdir):
+    path = tmpdir.join('queries.txt')
+    path.write_text('водолазка\t12051428\n\nплатье\n', encoding='utf8')
+    spider = make_spider(search_query_file=str(path), tracked_skus='14783266')
+
+    requests = list(spider.start_requests())
+
+    assert [r.url for r in requests] == [
+        WildberriesSpider.SEARCH_API_URL + '%D0%B2%D0%BE%D0%B4%D0%BE%D0%BB%D0%B0%D0%B7%D0%BA%D0%B0',
+        WildberriesSpider.SEARCH_API_URL + '%D0%BF%D0%BB%D0%B0%D1%82%D1%8C%D0%B5',
+    ]
+    assert [r.meta['tracked_skus'] for r in requests] == [{12051428, 14783266}, {14783266}]
+
+
+def search_request(tracked_skus=()):
+    return scrapy.Request(WildberriesSpider.SEARCH_API_URL + 'query', meta={
+        'search_query': 'водолазка',
+        'tracked_skus': set(tracked_skus),
+    })
+
+
+def test_search_walks_catalog_pages():
+    spider = make_spider()
+    page_request, = spider.parse_search(fixture_response(search_request(), 'wb_search.json'))
+    assert page_request.url == WildberriesSpider.SEARCH_CATALOG_URL + 'presets/bucket_71/catalog?preset=10027441&page=1'
+
+    items, requests = split_output(list(spider.parse_search_page_json(fixture_response(page_request, 'wb_catalog_page.json'))))
+
+    assert [(i['wb_id'], i['search_query'], i['search_position']) for i in items] == [
+        (8685970, 'водолазка', 1), (12051428, 'водолазка', 2), (14783266, 'водолазка', 3),
+    ]
+    assert [r.url for r in requests] == [WildberriesSpider.SEARCH_CATALOG_URL + 'presets/bucket_71/catalog?preset=10027441&page=2']
+    assert requests[0].meta['search']['position'] == 3
+
+
+def test_search_stops_when_tracked_skus_are_found():
+    spider = make_spider()
+    page_request, = spider.parse_search(fixture_response(search_request({12051428}), 'wb_search.json'))
+
+    output = list(spider.parse_search_page_json(fixture_response(page_request, 'wb_catalog_page.json')))
+
+    assert [(i['wb_id'], i['search_position']) for i in output] == [(12051428, 2)]
+    assert spider.crawler.stats.get_value('search/stopped_early') == 1
+
+
+def test_search_without_results():
+    spider = make_spider()
+    items = list(spider.parse_search(fixture_response(search_request({12051428}), 'wb_search_no_results.json')))
+
+    assert [(i['wb_id'], i['search_position']) for i in items] == [(12051428, None)]
+    assert spider.crawler.stats.get_value('search/no_results') == 1
+
+
+def test_search_bad_catalog_page():
+    spider = make_spider()
+    page_request, = spider.parse_search(fixture_response(search_request({12051428}), 'wb_search.json'))
+
+    items = list(spider.parse_search_page_json(fixture_response(page_request, 'wb_search_bad_page.json')))
+
+    # tracked SKUs are reported as not found instead of an AttributeError
+    assert [(i['wb_id'], i['search_position']) for i in items] == [(12051428, None)]
+    assert spider.crawler.stats.get_value('search/bad_pages') == 1
+
+
+def make_index_spider(tmpdir):
+    return make_spider({
+        'WB_CATEGORY_INDEX_ENABLED': True,
+        'WB_CATEGORY_INDEX_PATH': str(tmpdir.join('wb_categories.sqlite')),
+        'WB_CATEGORY_INDEX_TTL': 3600,
+    })
+
+
+def test_category_index_hit(tmpdir):
+    spider = make_index_spider(tmpdir)
+    spider.category_index.set(CATEGORY_URL, name='Водолазки', query=CATEGORY_QUERY, total=250, page_size=100)
+
+    requests = list(spider.follow_category(CATEGORY_URL + '?sort=popular'))
+
+    # catalog JSON pages are requested without the category page
+    assert [r.url for r in requests] == [WildberriesSpider.CATEGORY_API_URL + CATEGORY_QUERY + '&page=%d' % page for page in (1, 2, 3)]
+    assert spider.crawler.stats.get_value('category_index/hit') == 1
+    spider.category_index.close()
+
+
+def test_category_index_expired_entry(tmpdir):
+    spider = make_index_spider(tmpdir)
+    spider.category_index.set(CATEGORY_URL, _time=time.time() - 3601, name='Водолазки', query=CATEGORY_QUERY, total=250, page_size=100)
+
+    requests = list(spider.follow_category(CATEGORY_URL))
+
+    assert [(r.url, r.callback) for r in requests] == [(CATEGORY_URL, spider.parse_category)]
+    assert spider.crawler.stats.get_value('category_index/stale') == 1
+    spider.category_index.close()
+
+
+def test_category_index_refresh(tmpdir):
+    spider = make_index_spider(tmpdir)
+    spider.category_index.set(CATEGORY_URL, _time=time.time() - 3601, name='Водолазки', query='kind=2&subject=1', total=10, page_size=100)
+    request, = spider.follow_category(CATEGORY_URL)
+
+    list(spider.parse_category(fixture_response(request, 'wb_category.html')))
+
+    # the category page refreshes the entry, the next run uses it
+    assert spider.category_index.get(CATEGORY_URL) == {'name': 'Водолазки', 'query': CATEGORY_QUERY, 'total': 250, 'page_size': 2}
+    assert len(list(spider.follow_category(CATEGORY_URL))) == 125
+    spider.category_index.close()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares dukpy with parse_js_object on a wb.spa.init-like fixture.
+
+    python tools/bench_js_object.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+import dukpy
+
+# run as python tools/<name>.py from anywhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wildsearch_crawler.jsobject import eval_js_object
+
+
+def make_fixture(nomenclatures=50):
+    """ Object literal shaped like the one passed to wb.spa.init """
+    colors = []
+    for i in range(nomenclatures):
+        colors.append(
+            "{cod1S: %d, name: 'Цвет %d', ordersCount: %d, priceWithSale: %d.5, "
+            "sizes: [{name: 'S', optionId: %d, quantity: 1}, {name: 'M', optionId: %d, quantity: 0},], "
+            "isNew: false, rating: null}" % (i, i, i * 7, i * 100, i * 10, i * 10 + 1)
+        )
+    return (
+        "{router: {ssrModel: {product: {imtId: 12345, feedbacks: 42, "
+        "description: \"Описание \\\"товара\\\"\", colors: [%s]}, "
+        "selectedNomenclature: {cod1S: 1, ordersCount: 7}}}, "
+        "settings: {lang: 'ru', currency: 'RUB', features: %s}}"
+        % (', '.join(colors), json.dumps(list(range(100))))
+    )
+
+
+if __name__ == '__main__':
+    fixture = make_fixture()
+    number = 200
+
+    expected = dukpy.evaljs(f'init={fixture};init.router;')
+    assert eval_js_object(fixture, 'router') == expected
+
+    duk = timeit.timeit(lambda: dukpy.evaljs(f'init={fixture};init.router;'), number=number)
+    fast = timeit.timeit(lambda: eval_js_object(fixture, 'router'), number=number)
+
+    print('fixture: %d bytes' % len(fixture))
+    print('dukpy:           %8.1f us/page' % (duk / number * 1e6))
+    print('parse_js_object: %8.1f us/page' % (fast / number * 1e6))
+    print('speedup:         %8.1fx' % (duk / fast))
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+Time of PositionsStore.commit for snapshots of a few million positions,
+with a share of products moved, added and dropped between runs.
+
+    python tools/bench_positions.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+# run as python tools/<name>.py from anywhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wildsearch_crawler.positions import PositionsStore
+
+ROWS = (1000000, 3000000)
+CATEGORY_SIZE = 5000
+
+
+def fill(store, rows, seed):
+    rng = random.Random(seed)
+    skus = list(range(10000000, 10000000 + rows))
+
+    # about a tenth of products move between runs
+    for i in range(rows // 10):
+        j = rng.randrange(rows)
+        skus[i], skus[j] = skus[j], skus[i]
+
+    for i, sku in enumerate(skus):
+        store.add('https://www.wildberries.ru/catalog/%d' % (i // CATEGORY_SIZE), sku, i % CATEGORY_SIZE + 1)
+
+    # every category was crawled to the last page
+    for category in range(0, rows, CATEGORY_SIZE):
+        store.complete('https://www.wildberries.ru/catalog/%d' % (category // CATEGORY_SIZE))
+
+
+if __name__ == '__main__':
+    for rows in ROWS:
+        with tempfile.TemporaryDirectory() as path:
+            store = PositionsStore(path)
+            fill(store, rows, seed=1)
+            store.commit(_time=0)
+
+            store = PositionsStore(path)
+            fill(store, rows, seed=2)
+
+            started = time.perf_counter()
+            counts = store.commit(_time=1)
+            elapsed = time.perf_counter() - started
+
+            size = sum(os.path.getsize(os.path.join(path, name + '.bin')) for name, _ in PositionsStore.COLUMNS)
+            print('%8d rows: commit %.2fs, snapshot %.1f MB, %s' % (rows, elapsed, size / 2 ** 20, counts))
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-request cost of Proxies.get_random / mark_dead / mark_good
+for different pool sizes. Per-request time should stay flat.
+
+    python tools/bench_proxies.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+# run as python tools/<name>.py from anywhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wildsearch_crawler.expire import Proxies
+
+POOL_SIZES = (100, 1000, 10000, 100000)
+REQUESTS = 100000
+
+
+def make_pool(size):
+    proxies = Proxies(['http://10.%d.%d.%d:3128' % (i >> 16 & 255, i >> 8 & 255, i & 255)
+                       for i in range(size)])
+
+    # a realistic mix: some proxies are good, some are dead
+    for proxy in random.sample(list(proxies.proxies), size // 3):
+        proxies.mark_good(proxy)
+    for proxy in random.sample(list(proxies.proxies), size // 3):
+        proxies.mark_dead(proxy)
+
+    return proxies
+
+
+def one_request(proxies):
+    proxy = proxies.get_random()
+
+    if random.random() < 0.1:
+        proxies.mark_dead(proxy)
+    else:
+        proxies.mark_good(proxy)
+
+    if not proxies._available:
+        proxies.reset()
+
+
+if __name__ == '__main__':
+    for size in POOL_SIZES:
+        proxies = make_pool(size)
+        total = timeit.timeit(lambda: one_request(proxies), number=REQUESTS)
+        print('%7d proxies: %.2f us/request' % (size, total / REQUESTS * 1e6))
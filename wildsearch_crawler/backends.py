@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import uuid
+
+from .utils import open_sqlite
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteProxyStateBackend(object):
+    """
+    Shares proxies health between crawler processes running on the same
+    machine through a local SQLite database.
+    Each process appends rows of proxies which changed their state
+    (see Proxies.pop_changed) to an ``events`` table and reads rows
+    appended by other processes since the last read. Rows have the same
+    format as Proxies.dump_state, so they are applied with
+    Proxies.load_state. Rows are grouped by website host, see
+    ``ROTATING_PROXY_PER_HOST``.
+    A backend is any object with ``push(rows)``, ``pull()`` and ``close()``
+    methods, so SQLite can be replaced with another store.
+    Settings:
+    * ``ROTATING_PROXY_SHARED_STATE_PATH`` - path to the database file.
+    """
+    # old events are deleted when there are more of them than this
+    MAX_EVENTS = 100000
+
+    def __init__(self, path, origin=None):
+        self.path = path
+        self.origin = origin or uuid.uuid4().hex
+        self.conn = open_sqlite(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS events ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'origin TEXT NOT NULL, '
+            'host TEXT NOT NULL, '
+            'proxy TEXT NOT NULL, '
+            'state TEXT NOT NULL)'
+        )
+        # only changes made after the process started are interesting
+        row = self.conn.execute('SELECT MAX(id) FROM events').fetchone()
+        self.last_id = row[0] or 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('ROTATING_PROXY_SHARED_STATE_PATH',
+                                    'proxies_shared.sqlite')
+        return cls(path)
+
+    def push(self, rows):
+        """
+        Publish state rows of changed proxies to other processes.
+        ``rows`` is a {host: {proxy: row}} dict.
+        """
+        events = [
+            (self.origin, host, proxy, json.dumps(row, separators=(',', ':')))
+            for host, host_rows in rows.items()
+            for proxy, row in host_rows.items()
+        ]
+        if not events:
+            return
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.executemany(
+                'INSERT INTO events (origin, host, proxy, state) '
+                'VALUES (?, ?, ?, ?)',
+                events
+            )
+            self.conn.execute('DELETE FROM events WHERE id <= '
+                              '(SELECT MAX(id) FROM events) - ?',
+                              (self.MAX_EVENTS,))
+
+    def pull(self):
+        """
+        Return {host: {proxy: row}} dict of state rows published by other
+        processes since the last pull.
+        """
+        cursor = self.conn.execute(
+            'SELECT id, origin, host, proxy, state FROM events '
+            'WHERE id > ? ORDER BY id',
+            (self.last_id,)
+        )
+        rows = {}
+        for event_id, origin, host, proxy, state in cursor:
+            self.last_id = event_id
+            if origin != self.origin:
+                rows.setdefault(host, {})[proxy] = json.loads(state)
+        return rows
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+from scrapy.exceptions import NotConfigured
+
+from .utils import open_sqlite
+
+logger = logging.getLogger(__name__)
+
+
+class FirstReviewDateCache(object):
+    """
+    Persistent cache of product first review dates, so that reviews pages
+    are requested only once per product and not on every run.
+    A date is stored under several keys (e.g. imt id, shared by all color
+    variants of a product, and the product id) and is found by any of them.
+    The first review date never changes once a product has reviews, so
+    such entries don't expire. Products without reviews are cached as
+    None for ``empty_ttl`` seconds only.
+    Settings:
+    * ``FIRST_REVIEW_CACHE_ENABLED`` - Default: False.
+    * ``FIRST_REVIEW_CACHE_PATH`` - path to the database file.
+      Default: 'first_review_dates.sqlite'.
+    * ``FIRST_REVIEW_CACHE_EMPTY_TTL`` - how long to trust that a product
+      has no reviews, in seconds. Default: 86400.
+    """
+    def __init__(self, path, empty_ttl=86400, stats=None):
+        self.path = path
+        self.empty_ttl = empty_ttl
+        self.stats = stats
+        self.conn = open_sqlite(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS first_review_dates ('
+            'key TEXT PRIMARY KEY, '
+            'date TEXT, '
+            'updated_at REAL NOT NULL)'
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        if not s.getbool('FIRST_REVIEW_CACHE_ENABLED', False):
+            raise NotConfigured()
+        path = s.get('FIRST_REVIEW_CACHE_PATH', 'first_review_dates.sqlite')
+        return cls(
+            path=path,
+            empty_ttl=s.getfloat('FIRST_REVIEW_CACHE_EMPTY_TTL', 86400),
+            stats=crawler.stats,
+        )
+
+    def get(self, keys, _time=None):
+        """
+        Return ``(found, date)`` for the first of ``keys`` which is cached.
+        ``date`` is None for products known to have no reviews yet.
+        """
+        keys = [key for key in keys if key]
+        now = _time if _time is not None else time.time()
+        if keys:
+            rows = dict(
+                (key, (date, updated_at)) for key, date, updated_at in
+                self.conn.execute(
+                    'SELECT key, date, updated_at FROM first_review_dates '
+                    'WHERE key IN (%s)' % ','.join('?' * len(keys)),
+                    keys
+                )
+            )
+            for key in keys:
+                if key not in rows:
+                    continue
+                date, updated_at = rows[key]
+                if date is None and now - updated_at > self.empty_ttl:
+                    self._inc_stats('expired')
+                    continue
+                self._inc_stats('hit')
+                return True, date
+        self._inc_stats('miss')
+        return False, None
+
+    def set(self, keys, date, _time=None):
+        """ Store ``date`` (None if there are no reviews) under ``keys`` """
+        now = _time if _time is not None else time.time()
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO first_review_dates '
+                '(key, date, updated_at) VALUES (?, ?, ?)',
+                [(key, date, now) for key in keys if key]
+            )
+
+    def close(self):
+        self.conn.close()
+
+    def _inc_stats(self, name):
+        if self.stats is not None:
+            self.stats.inc_value('first_review_cache/' + name)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+from scrapy.exceptions import NotConfigured
+
+from .utils import open_sqlite
+
+logger = logging.getLogger(__name__)
+
+
+class CategoryIndex(object):
+    """
+    Persistent index of Wildberries category metadata: name, xcatalog
+    query of catalog JSON API, number of goods and page size, by category
+    URL. With it, category pages are requested through JSON API without
+    downloading category HTML first, and the crawl starts without the
+    main menu while the list of categories seen in it is fresh.
+    Metadata is filled by WildberriesSpider.parse_category, and the list
+    of categories by ``parse_main_menu`` of wb and wb_categories spiders.
+    Both expire after ``ttl`` seconds.
+    Hits, misses and stale entries are counted in ``category_index/*``
+    stats; ``category_index/max_age`` is the age of the oldest entry used.
+    Settings:
+    * ``WB_CATEGORY_INDEX_ENABLED`` - Default: False.
+    * ``WB_CATEGORY_INDEX_PATH`` - path to the database file.
+      Default: 'wb_categories.sqlite'.
+    * ``WB_CATEGORY_INDEX_TTL`` - Default: 86400.
+    """
+    FIELDS = ('name', 'query', 'total', 'page_size')
+
+    def __init__(self, path, ttl=86400, stats=None):
+        self.path = path
+        self.ttl = ttl
+        self.stats = stats
+        self.conn = open_sqlite(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS categories ('
+            'url TEXT PRIMARY KEY, '
+            'name TEXT, '
+            'query TEXT, '
+            'total INTEGER, '
+            'page_size INTEGER, '
+            'updated_at REAL, '
+            'listed_at REAL)'
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        if not s.getbool('WB_CATEGORY_INDEX_ENABLED', False):
+            raise NotConfigured()
+        path = s.get('WB_CATEGORY_INDEX_PATH', 'wb_categories.sqlite')
+        return cls(
+            path=path,
+            ttl=s.getfloat('WB_CATEGORY_INDEX_TTL', 86400),
+            stats=crawler.stats,
+        )
+
+    def get(self, url, _time=None):
+        """
+        Return a dict of category metadata, or None if it's unknown or
+        older than ttl
+        """
+        now = _time if _time is not None else time.time()
+        row = self.conn.execute(
+            'SELECT name, query, total, page_size, updated_at FROM categories '
+            'WHERE url = ? AND updated_at IS NOT NULL', (url,)
+        ).fetchone()
+        if row is None:
+            self._inc_stats('miss')
+            return None
+        age = now - row[-1]
+        if age > self.ttl:
+            self._inc_stats('stale')
+            return None
+        self._inc_stats('hit')
+        self._max_stats('max_age', int(age))
+        return dict(zip(self.FIELDS, row))
+
+    def set(self, url, _time=None, **fields):
+        """ Store metadata (see FIELDS) of a category """
+        now = _time if _time is not None else time.time()
+        self.conn.execute(
+            'INSERT INTO categories '
+            '(url, name, query, total, page_size, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (url) DO UPDATE SET name = excluded.name, '
+            'query = excluded.query, total = excluded.total, '
+            'page_size = excluded.page_size, updated_at = excluded.updated_at',
+            (url,) + tuple(fields.get(name) for name in self.FIELDS) + (now,)
+        )
+
+    def set_listed(self, categories, _time=None):
+        """
+        Remember ``categories``, a list of (url, name) tuples, as the
+        current list of categories from the main menu
+        """
+        now = _time if _time is not None else time.time()
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(
+                'INSERT INTO categories (url, name, listed_at) '
+                'VALUES (?, ?, ?) '
+                'ON CONFLICT (url) DO UPDATE SET listed_at = excluded.listed_at',
+                [(url, name, now) for url, name in categories]
+            )
+
+    def get_listed(self, _time=None):
+        """
+        Return (url, name) tuples of categories from the main menu, or an
+        empty list if the menu wasn't seen within ttl
+        """
+        now = _time if _time is not None else time.time()
+        listed_at, = self.conn.execute(
+            'SELECT MAX(listed_at) FROM categories').fetchone()
+        if listed_at is None or now - listed_at > self.ttl:
+            self._inc_stats('menu_miss')
+            return []
+        self._inc_stats('menu_hit')
+        self._max_stats('max_age', int(now - listed_at))
+        # categories which disappeared from the menu were listed earlier
+        return self.conn.execute(
+            'SELECT url, name FROM categories WHERE listed_at = ? '
+            'ORDER BY url', (listed_at,)
+        ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+    def _inc_stats(self, name):
+        if self.stats is not None:
+            self.stats.inc_value('category_index/' + name)
+
+    def _max_stats(self, name, value):
+        if self.stats is not None:
+            self.stats.max_value('category_index/' + name, value)
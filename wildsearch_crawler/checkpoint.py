@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import pickle
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.job import job_dir
+from twisted.internet import task
+
+from .utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# sent every CHECKPOINT_INTERVAL seconds, components which keep crawl state
+# in JOBDIR connect to it to save the state (see MarketplaceIdDupeFilter)
+checkpoint = object()
+
+
+class Checkpoint(object):
+    """
+    Extension which saves crawl state to JOBDIR every
+    ``CHECKPOINT_INTERVAL`` seconds, and not only when the crawl is closed
+    gracefully, so that a crashed crawl can be resumed with the same
+    JOBDIR. Scheduled requests are written to disk right away by
+    wildsearch_crawler.squeues and wildsearch_crawler.pqueues, a
+    checkpoint saves:
+    * ``spider.state`` dict, which is otherwise saved on close;
+    * state of components connected to ``checkpoint`` signal, such as
+      seen requests of MarketplaceIdDupeFilter.
+    Requests which were being downloaded when the crawl crashed are lost,
+    requests seen after the last checkpoint may be downloaded again.
+    Settings:
+    * ``CHECKPOINT_INTERVAL`` - Default: 300.
+    """
+    def __init__(self, crawler, jobdir, interval):
+        self.crawler = crawler
+        self.jobdir = jobdir
+        self.interval = interval
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        jobdir = job_dir(crawler.settings)
+        interval = crawler.settings.getfloat('CHECKPOINT_INTERVAL', 300)
+        if not jobdir or not interval:
+            raise NotConfigured()
+        ext = cls(crawler, jobdir, interval)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.task = task.LoopingCall(self.checkpoint)
+        self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+
+    def checkpoint(self):
+        self.crawler.signals.send_catch_log(checkpoint, spider=self.spider)
+        state = getattr(self.spider, 'state', None)
+        if state is not None:
+            # the same file as SpiderState extension uses
+            path = os.path.join(self.jobdir, 'spider.state')
+            write_atomic(path, pickle.dumps(state, protocol=4))
+        logger.debug("Saved checkpoint to %s", self.jobdir,
+                     extra={'spider': self.spider})
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+import bisect
+import hashlib
+import logging
+import math
+import os
+import re
+import struct
+import sys
+from array import array
+
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.utils.job import job_dir
+from scrapy.utils.request import referer_str
+from w3lib.url import canonicalize_url
+
+from .checkpoint import checkpoint
+from .utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# marketplace name -> regex with product id in the first group
+ID_PATTERNS = {
+    'wildberries': re.compile(r'^https?://(?:www\.)?wildberries\.ru/catalog/(\d+)/detail\.aspx'),
+    'ozon': re.compile(r'^https?://(?:www\.)?ozon\.ru/(?:context/detail/id/|product/[^/?#]*?-?)(\d+)/'),
+}
+
+
+class IdSet(object):
+    """
+    Compact set of non-negative integers, a simplified Roaring bitmap.
+    Ids are split into chunks by their high bits. A chunk with few ids
+    keeps them as a sorted array of 2-byte low bits; once it gets
+    ``ARRAY_MAX`` ids it turns into a 8KB bitmap. So ids take at most
+    2 bytes each, and much less in dense ranges, while a Python set of
+    ints takes about 60 bytes per id.
+    """
+    ARRAY_MAX = 4096
+    BITMAP_BYTES = 1 << 13
+    CHUNK = struct.Struct('>IBI')
+
+    def __init__(self):
+        # high bits -> array('H') of sorted low bits or bytearray bitmap
+        self.chunks = {}
+        self.count = 0
+
+    def add(self, value):
+        """ Add ``value``, return True if it wasn't in the set """
+        high, low = value >> 16, value & 0xFFFF
+        chunk = self.chunks.get(high)
+        if chunk is None:
+            chunk = self.chunks[high] = array('H')
+        if isinstance(chunk, bytearray):
+            mask = 1 << (low & 7)
+            if chunk[low >> 3] & mask:
+                return False
+            chunk[low >> 3] |= mask
+        else:
+            index = bisect.bisect_left(chunk, low)
+            if index < len(chunk) and chunk[index] == low:
+                return False
+            chunk.insert(index, low)
+            if len(chunk) >= self.ARRAY_MAX:
+                self.chunks[high] = self._to_bitmap(chunk)
+        self.count += 1
+        return True
+
+    def __contains__(self, value):
+        high, low = value >> 16, value & 0xFFFF
+        chunk = self.chunks.get(high)
+        if chunk is None:
+            return False
+        if isinstance(chunk, bytearray):
+            return bool(chunk[low >> 3] & (1 << (low & 7)))
+        index = bisect.bisect_left(chunk, low)
+        return index < len(chunk) and chunk[index] == low
+
+    def __len__(self):
+        return self.count
+
+    def _to_bitmap(self, chunk):
+        bitmap = bytearray(self.BITMAP_BYTES)
+        for low in chunk:
+            bitmap[low >> 3] |= 1 << (low & 7)
+        return bitmap
+
+    def to_bytes(self):
+        parts = [struct.pack('>Q', self.count)]
+        for high, chunk in sorted(self.chunks.items()):
+            if isinstance(chunk, bytearray):
+                data = bytes(chunk)
+            else:
+                # arrays are stored big-endian, like the headers
+                data = array('H', chunk)
+                if sys.byteorder == 'little':
+                    data.byteswap()
+                data = data.tobytes()
+            parts.append(self.CHUNK.pack(high, isinstance(chunk, bytearray), len(data)))
+            parts.append(data)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        id_set = cls()
+        id_set.count, = struct.unpack_from('>Q', data)
+        pos = 8
+        while pos < len(data):
+            high, is_bitmap, size = cls.CHUNK.unpack_from(data, pos)
+            pos += cls.CHUNK.size
+            if is_bitmap:
+                chunk = bytearray(data[pos:pos + size])
+            else:
+                chunk = array('H')
+                chunk.frombytes(data[pos:pos + size])
+                if sys.byteorder == 'little':
+                    chunk.byteswap()
+            id_set.chunks[high] = chunk
+            pos += size
+        return id_set
+
+
+class BloomFilter(object):
+    """
+    Bloom filter for ``capacity`` items with ``error_rate`` false positive
+    rate; the rate grows if more items are added.
+    """
+    HEADER = struct.Struct('>QII')
+
+    def __init__(self, capacity, error_rate, bits=None, num_hashes=None, count=0):
+        if bits is None:
+            size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+            bits = bytearray((size + 7) // 8)
+            num_hashes = max(1, round(size / capacity * math.log(2)))
+        self.bits = bits
+        self.size = len(bits) * 8
+        self.num_hashes = num_hashes
+        self.capacity = capacity
+        self.count = count
+
+    def add(self, key):
+        """ Add ``key`` (bytes), return True if it wasn't in the filter """
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        # double hashing: i-th index is h1 + i * h2
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        new = False
+        for i in range(self.num_hashes):
+            index = (h1 + i * h2) % self.size
+            mask = 1 << (index & 7)
+            if not self.bits[index >> 3] & mask:
+                self.bits[index >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+            if self.count == self.capacity + 1:
+                logger.warning("Bloom filter is over its capacity of %d items, "
+                               "false positive rate will grow", self.capacity)
+        return new
+
+    def to_bytes(self):
+        return self.HEADER.pack(self.count, self.num_hashes, self.capacity) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data, error_rate):
+        count, num_hashes, capacity = cls.HEADER.unpack_from(data)
+        return cls(capacity, error_rate, bytearray(data[cls.HEADER.size:]),
+                   num_hashes, count)
+
+
+class MarketplaceIdDupeFilter(BaseDupeFilter):
+    """
+    Duplicates filter which knows product page URLs of marketplaces.
+    Product pages (see ID_PATTERNS) are identified by product id, so
+    URLs of the same product with different query strings are duplicates,
+    and seen ids are kept in a compact IdSet. Other requests
+    go to a Bloom filter of their fingerprints, which may rarely filter
+    a request which wasn't seen.
+    With JOBDIR, seen ids and the Bloom filter are saved on close and on
+    ``checkpoint`` signal (see wildsearch_crawler.checkpoint), and loaded
+    back when the crawl is resumed.
+    Settings:
+    * ``DUPEFILTER_BLOOM_CAPACITY`` - Default: 10000000.
+    * ``DUPEFILTER_BLOOM_ERROR_RATE`` - Default: 0.001.
+    * ``DUPEFILTER_DEBUG`` - log all filtered requests. Default: False.
+    """
+    def __init__(self, path=None, debug=False, bloom_capacity=10000000,
+                 bloom_error_rate=0.001):
+        self.path = path
+        self.debug = debug
+        self.logdupes = True
+        self.bloom_error_rate = bloom_error_rate
+        self.ids = {name: IdSet() for name in ID_PATTERNS}
+        self.bloom = None
+        if path:
+            self.load()
+        if self.bloom is None:
+            self.bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        df = cls(
+            path=job_dir(s),
+            debug=s.getbool('DUPEFILTER_DEBUG'),
+            bloom_capacity=s.getint('DUPEFILTER_BLOOM_CAPACITY', 10000000),
+            bloom_error_rate=s.getfloat('DUPEFILTER_BLOOM_ERROR_RATE', 0.001),
+        )
+        if df.path:
+            crawler.signals.connect(df.save, signal=checkpoint)
+        return df
+
+    def request_seen(self, request):
+        if request.method == 'GET':
+            for name, pattern in ID_PATTERNS.items():
+                match = pattern.match(request.url)
+                if match is not None:
+                    return not self.ids[name].add(int(match.group(1)))
+        return not self.bloom.add(self.request_key(request))
+
+    def request_key(self, request):
+        return b'\n'.join((
+            request.method.encode('ascii'),
+            canonicalize_url(request.url).encode('utf8'),
+            request.body or b'',
+        ))
+
+    def close(self, reason):
+        if self.path:
+            self.save()
+
+    def load(self):
+        for name in self.ids:
+            data = self._read('ids.%s.bin' % name)
+            if data is not None:
+                self.ids[name] = IdSet.from_bytes(data)
+        data = self._read('requests.bloom')
+        if data is not None:
+            self.bloom = BloomFilter.from_bytes(data, self.bloom_error_rate)
+            logger.info("Loaded seen requests from %s", self.path)
+
+    def save(self):
+        for name, id_set in self.ids.items():
+            self._write('ids.%s.bin' % name, id_set.to_bytes())
+        self._write('requests.bloom', self.bloom.to_bytes())
+
+    def log(self, request, spider):
+        if self.debug:
+            msg = "Filtered duplicate request: %(request)s (referer: %(referer)s)"
+            args = {'request': request, 'referer': referer_str(request)}
+            logger.debug(msg, args, extra={'spider': spider})
+        elif self.logdupes:
+            msg = ("Filtered duplicate request: %(request)s"
+                   " - no more duplicates will be shown"
+                   " (see DUPEFILTER_DEBUG to show all duplicates)")
+            logger.debug(msg, {'request': request}, extra={'spider': spider})
+            self.logdupes = False
+        spider.crawler.stats.inc_value('dupefilter/filtered', spider=spider)
+
+    def _read(self, filename):
+        path = os.path.join(self.path, filename)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _write(self, filename, data):
+        write_atomic(os.path.join(self.path, filename), data)
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import heapq
 import logging
 import math
 import random
@@ -25,8 +26,16 @@ class Proxies(object):
     'Dead' proxies move to 'unchecked' after a timeout (they are called
     'reanimated'). This timeout increases exponentially after each
     unsuccessful attempt to use a proxy.
+    Dead proxies are kept in a min-heap ordered by their ``next_check``
+    time, so reanimation only looks at proxies which are due.
+    Counters used for stats (reanimated proxies, total backoff time of
+    dead proxies) are updated on each state change.
+    With ``prefer_good`` only good proxies are available while there are
+    any, unchecked ones are used only when no proxy is known to be good.
+    It is meant for proxies which are checked by ProxyProber.
     """
-    def __init__(self, proxy_list, backoff=None):
+    def __init__(self, proxy_list, backoff=None, ewma_alpha=0.3,
+                 prefer_good=False):
         self.proxies = {url: ProxyState() for url in proxy_list}
         self.proxies_by_hostport = {
             extract_proxy_hostport(proxy): proxy
@@ -36,17 +45,96 @@ class Proxies(object):
         self.good = set()
         self.dead = set()
 
+        # available (good or unchecked) proxies are kept in a list with
+        # a position index, so that random choice and removal are O(1)
+        self._available = list(self.unchecked)
+        self._available_pos = {
+            proxy: pos for pos, proxy in enumerate(self._available)
+        }
+        # the same for good proxies, used with prefer_good
+        self.prefer_good = prefer_good
+        self._good = []
+        self._good_pos = {}
+
+        # (next_check, proxy) pairs; entries which don't match current
+        # proxy state are stale and skipped when popped
+        self._reanimate_heap = []
+
+        self._n_reanimated = 0
+        self._total_backoff = 0.0
+
+        # proxies which became good or dead, see pop_changed
+        self._changed = set()
+
         if backoff is None:
             backoff = exp_backoff_full_jitter
         self.backoff = backoff
+        self.ewma_alpha = ewma_alpha
+
+    @property
+    def available(self):
+        """
+        List of available (good or unchecked) proxies, or only good ones
+        if there are any and ``prefer_good`` is set.
+        It is updated in place, don't modify it.
+        """
+        if self.prefer_good and self._good:
+            return self._good
+        return self._available
 
     def get_random(self):
         """ Return a random available proxy (either good or unchecked) """
-        available = list(self.unchecked | self.good)
+        available = self.available
         if not available:
             return None
         return random.choice(available)
 
+    def record_result(self, proxy, success, latency=None):
+        """
+        Update moving averages of success rate and download latency
+        of a proxy.
+        """
+        state = self.proxies.get(proxy)
+        if state is None:
+            return
+
+        alpha = self.ewma_alpha
+        state.success_rate += alpha * (float(success) - state.success_rate)
+        if latency is not None:
+            if state.latency is None:
+                state.latency = latency
+            else:
+                state.latency += alpha * (latency - state.latency)
+
+    def add_proxies(self, proxy_list):
+        """ Add new proxies as unchecked; known proxies keep their state """
+        n_added = 0
+        for proxy in proxy_list:
+            if proxy in self.proxies:
+                continue
+            self.proxies[proxy] = ProxyState()
+            self.proxies_by_hostport[extract_proxy_hostport(proxy)] = proxy
+            self.unchecked.add(proxy)
+            self._add_available(proxy)
+            n_added += 1
+        return n_added
+
+    def remove_proxies(self, proxy_list):
+        """ Forget proxies, whatever state they are in """
+        n_removed = 0
+        for proxy in proxy_list:
+            if proxy not in self.proxies:
+                continue
+            self._leave_state(proxy)
+            self._remove_available(proxy)
+            self._changed.discard(proxy)
+            del self.proxies[proxy]
+            hostport = extract_proxy_hostport(proxy)
+            if self.proxies_by_hostport.get(hostport) == proxy:
+                del self.proxies_by_hostport[hostport]
+            n_removed += 1
+        return n_removed
+
     def get_proxy(self, proxy_address):
         """
         Return complete proxy name associated with a hostport of a given
@@ -69,15 +157,18 @@ class Proxies(object):
         else:
             logger.debug("Proxy <%s> is DEAD" % proxy)
 
-        self.unchecked.discard(proxy)
-        self.good.discard(proxy)
-        self.dead.add(proxy)
+        self._leave_state(proxy)
+        self._remove_available(proxy)
 
         now = _time or time.time()
         state = self.proxies[proxy]
         state.backoff_time = self.backoff(state.failed_attempts)
         state.next_check = now + state.backoff_time
         state.failed_attempts += 1
+        self.dead.add(proxy)
+        self._total_backoff += state.backoff_time
+        self._changed.add(proxy)
+        heapq.heappush(self._reanimate_heap, (state.next_check, proxy))
 
     def mark_good(self, proxy):
         """ Mark a proxy as good """
@@ -87,44 +178,163 @@ class Proxies(object):
 
         if proxy not in self.good:
             logger.debug("Proxy <%s> is GOOD" % proxy)
+            self._changed.add(proxy)
 
-        self.unchecked.discard(proxy)
-        self.dead.discard(proxy)
-        self.good.add(proxy)
+        self._leave_state(proxy)
+        self._mark_good(proxy)
         self.proxies[proxy].failed_attempts = 0
 
+    def dump_state(self):
+        """
+        Return a JSON-serializable snapshot of proxies health, to be
+        restored with ``load_state`` in another crawl.
+        """
+        return {proxy: self._dump_row(proxy) for proxy in self.proxies}
+
+    def pop_changed(self):
+        """
+        Return a ``dump_state``-like snapshot of proxies which became
+        good or dead since the previous call.
+        """
+        changed, self._changed = self._changed, set()
+        return {proxy: self._dump_row(proxy) for proxy in changed}
+
+    def _dump_row(self, proxy):
+        state = self.proxies[proxy]
+        if proxy in self.good:
+            status = 'good'
+        elif proxy in self.dead:
+            status = 'dead'
+        else:
+            status = 'unchecked'
+        return [status, state.failed_attempts, state.next_check,
+                state.backoff_time, state.latency, state.success_rate]
+
+    def load_state(self, data, _time=None):
+        """
+        Restore proxies health from a ``dump_state`` snapshot.
+        Unknown proxies are ignored; dead proxies whose backoff timeout
+        already passed become reanimated. Return a number of restored
+        proxies.
+        """
+        n_loaded = 0
+        now = _time or time.time()
+        for proxy, row in data.items():
+            if proxy not in self.proxies:
+                continue
+            status, failed_attempts, next_check, backoff_time, latency, \
+                success_rate = row
+
+            self._leave_state(proxy)
+            state = self.proxies[proxy]
+            state.failed_attempts = failed_attempts
+            state.next_check = next_check
+            state.backoff_time = backoff_time
+            state.latency = latency
+            state.success_rate = success_rate
+
+            if status == 'good':
+                self._mark_good(proxy)
+            elif status == 'dead' and next_check > now:
+                self.dead.add(proxy)
+                self._remove_available(proxy)
+                self._total_backoff += backoff_time
+                heapq.heappush(self._reanimate_heap, (next_check, proxy))
+            else:
+                self.unchecked.add(proxy)
+                if failed_attempts:
+                    self._n_reanimated += 1
+                self._add_available(proxy)
+            n_loaded += 1
+        return n_loaded
+
     def reanimate(self, _time=None):
         """ Move dead proxies to unchecked if a backoff timeout passes """
         n_reanimated = 0
         now = _time or time.time()
-        for proxy in list(self.dead):
-            state = self.proxies[proxy]
-            assert state.next_check is not None
-            if state.next_check <= now:
-                self.dead.remove(proxy)
-                self.unchecked.add(proxy)
-                n_reanimated += 1
+        heap = self._reanimate_heap
+        while heap and heap[0][0] <= now:
+            next_check, proxy = heapq.heappop(heap)
+            if self._is_stale(next_check, proxy):
+                continue
+            self._mark_reanimated(proxy)
+            n_reanimated += 1
         return n_reanimated
 
     def reset(self):
         """ Mark all dead proxies as unchecked """
         for proxy in list(self.dead):
+            self._mark_reanimated(proxy)
+        self._reanimate_heap = []
+
+    def _mark_good(self, proxy):
+        self.good.add(proxy)
+        self._add_available(proxy)
+        _indexed_add(self._good, self._good_pos, proxy)
+
+    def _mark_reanimated(self, proxy):
+        self._leave_state(proxy)
+        self.unchecked.add(proxy)
+        self._n_reanimated += 1
+        self._add_available(proxy)
+
+    def _leave_state(self, proxy):
+        """ Remove a proxy from its current state set, updating counters """
+        state = self.proxies[proxy]
+        if proxy in self.dead:
             self.dead.remove(proxy)
-            self.unchecked.add(proxy)
+            self._total_backoff -= state.backoff_time
+            if not self.dead:
+                # don't let float errors accumulate
+                self._total_backoff = 0.0
+        elif proxy in self.unchecked:
+            self.unchecked.remove(proxy)
+            if state.failed_attempts:
+                self._n_reanimated -= 1
+        elif proxy in self.good:
+            self.good.remove(proxy)
+            _indexed_remove(self._good, self._good_pos, proxy)
+
+    @property
+    def next_reanimation_time(self):
+        """
+        Return the time when the next dead proxy should be reanimated,
+        or None if there are no dead proxies.
+        """
+        heap = self._reanimate_heap
+        while heap and self._is_stale(*heap[0]):
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return heap[0][0]
+
+    def _is_stale(self, next_check, proxy):
+        return (proxy not in self.dead or
+                self.proxies[proxy].next_check != next_check)
+
+    def _add_available(self, proxy):
+        _indexed_add(self._available, self._available_pos, proxy)
+
+    def _remove_available(self, proxy):
+        _indexed_remove(self._available, self._available_pos, proxy)
 
     @property
     def mean_backoff_time(self):
         if not self.dead:
             return 0.0
-        total_backoff = sum(self.proxies[p].backoff_time for p in self.dead)
-        return float(total_backoff) / len(self.dead)
+        return float(self._total_backoff) / len(self.dead)
 
     @property
     def reanimated(self):
         return [p for p in self.unchecked if self.proxies[p].failed_attempts]
 
+    @property
+    def n_reanimated(self):
+        """ Number of reanimated proxies, same as len(self.reanimated) """
+        return self._n_reanimated
+
     def __str__(self):
-        n_reanimated = len(self.reanimated)
+        n_reanimated = self.n_reanimated
         return "Proxies(good: {}, dead: {}, unchecked: {}, reanimated: {}, " \
                "mean backoff time: {}s)".format(
             len(self.good), len(self.dead),
@@ -133,11 +343,33 @@ class Proxies(object):
         )
 
 
+def _indexed_add(items, positions, item):
+    """ Append an item to a list with a {item: position} index """
+    if item in positions:
+        return
+    positions[item] = len(items)
+    items.append(item)
+
+
+def _indexed_remove(items, positions, item):
+    """ Swap-remove an item from a list with a {item: position} index """
+    pos = positions.pop(item, None)
+    if pos is None:
+        return
+    last = items.pop()
+    if pos < len(items):
+        items[pos] = last
+        positions[last] = pos
+
+
 @attr.s
 class ProxyState(object):
     failed_attempts = attr.ib(default=0)
     next_check = attr.ib(default=None)
     backoff_time = attr.ib(default=None)  # for debugging
+    # exponentially weighted moving averages, see Proxies.record_result
+    latency = attr.ib(default=None)
+    success_rate = attr.ib(default=1.0)
 
 
 def exp_backoff(attempt, cap=3600, base=300):
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+
+from .utils import open_sqlite
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogFingerprints(object):
+    """
+    Persistent fingerprints of wb catalog products from previous runs.
+    A fingerprint is a 64-bit hash of the catalog fields which change
+    when product details are worth downloading again (see FIELDS), so a
+    product takes a row of two integers.
+    Settings:
+    * ``WB_FINGERPRINTS_PATH`` - path to the database file.
+      Default: 'wb_fingerprints.sqlite'.
+    """
+    FIELDS = ('salePrice', 'feedbackCount', 'brand', 'name')
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = open_sqlite(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints ('
+            'sku INTEGER PRIMARY KEY, '
+            'fingerprint INTEGER NOT NULL)'
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('WB_FINGERPRINTS_PATH',
+                                    'wb_fingerprints.sqlite')
+        return cls(path)
+
+    @classmethod
+    def fingerprint(cls, product):
+        """ Return fingerprint of a product dict from catalog JSON """
+        data = '\x1f'.join(str(product.get(name)) for name in cls.FIELDS)
+        digest = hashlib.blake2b(data.encode('utf8'), digest_size=8).digest()
+        # SQLite integers are signed
+        return int.from_bytes(digest, 'big', signed=True)
+
+    def changed(self, fingerprints):
+        """
+        Return a set of skus from {sku: fingerprint} dict which are new
+        or whose fingerprint differs from the stored one
+        """
+        if not fingerprints:
+            return set()
+        skus = list(fingerprints)
+        stored = dict(self.conn.execute(
+            'SELECT sku, fingerprint FROM fingerprints WHERE sku IN (%s)'
+            % ','.join('?' * len(skus)), skus
+        ))
+        return {sku for sku, fp in fingerprints.items() if stored.get(sku) != fp}
+
+    def store(self, fingerprints):
+        """ Save {sku: fingerprint} dict """
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO fingerprints (sku, fingerprint) '
+                'VALUES (?, ?)', fingerprints.items()
+            )
+
+    def close(self):
+        self.conn.close()
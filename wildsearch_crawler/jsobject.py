@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import re
+
+import dukpy
+
+logger = logging.getLogger(__name__)
+
+_STRING_RE = re.compile(r"""("[^"\\]*(?:\\.[^"\\]*)*"|'[^'\\]*(?:\\.[^'\\]*)*')""", re.DOTALL)
+
+# code outside of string literals is processed in one piece, with strings
+# replaced by this placeholder
+_PLACEHOLDER = '\x00'
+
+# patterns start with a literal or a small character set where possible:
+# CPython's re skips ahead to those quickly, while a leading lookbehind
+# is checked at every position and makes a search several times slower.
+# Group references in replacement templates are expanded in Python code,
+# so keys are quoted with split() instead of sub().
+_KEY_RE = re.compile(r'([{,]\s*)([A-Za-z_$][\w$]*)(?=\s*:)')
+_TRAILING_COMMA_RE = re.compile(r',(?=\s*[}\]])')
+# an array hole is a comma right after '[' or another comma; two patterns
+# starting with a literal are much faster than one starting with [\[,]
+_HOLE_AFTER_BRACKET_RE = re.compile(r'\[(?=\s*,)')
+_HOLE_AFTER_COMMA_RE = re.compile(r',(?=\s*,)')
+_UNDEFINED_RE = re.compile(r'\bundefined\b')
+_LEADING_DOT_RE = re.compile(r'\.(?<!\d\.)(?=\d)')
+_TRAILING_DOT_RE = re.compile(r'\.(?<=\d\.)(?!\d)')
+
+_JS_ESCAPE_RE = re.compile(r'''\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|.)''', re.DOTALL)
+
+_JS_ESCAPES = {
+    'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v',
+    '0': '\0', '\n': '',
+}
+
+
+def parse_js_object(text):
+    """
+    Convert a JavaScript object literal to Python objects without running
+    a JS interpreter:
+    >>> parse_js_object("{a: 1, 'b': [true, undefined,], c: \\"d\\"}")
+    {'a': 1, 'b': [True, None], 'c': 'd'}
+
+    The literal is rewritten to JSON with a few regex substitutions and
+    loaded with json module, which is much faster than booting a JS
+    interpreter. Anything beyond plain data (variables, function calls,
+    expressions) raises ValueError. Unlike with dukpy, keys with undefined
+    values are kept, with None values. Like with dukpy, which returns the
+    result through JSON, NaN, Infinity and array holes become None.
+    """
+    if _PLACEHOLDER in text:
+        raise ValueError("Unsupported character in JS object literal")
+    parts = _STRING_RE.split(text)
+    strings = [_to_json_string(string) for string in parts[1::2]]
+    code = _PLACEHOLDER.join(parts[0::2])
+
+    pieces = _KEY_RE.split(code)
+    pieces[2::3] = ['"' + key + '"' for key in pieces[2::3]]
+    code = ''.join(pieces)
+    if _HOLE_AFTER_BRACKET_RE.search(code) is not None:
+        code = _HOLE_AFTER_BRACKET_RE.sub('[null', code)
+    if _HOLE_AFTER_COMMA_RE.search(code) is not None:
+        code = _HOLE_AFTER_COMMA_RE.sub(',null', code)
+    code = _TRAILING_COMMA_RE.sub('', code)
+    if 'undefined' in code:
+        code = _UNDEFINED_RE.sub('null', code)
+    if '.' in code:
+        code = _LEADING_DOT_RE.sub('0.', code)
+        code = _TRAILING_DOT_RE.sub('.0', code)
+    # any other identifiers (variables, function calls) are left as is
+    # and make json.loads fail
+
+    code_parts = code.split(_PLACEHOLDER)
+    result = [None] * (len(code_parts) + len(strings))
+    result[0::2] = code_parts
+    result[1::2] = strings
+    return json.loads(''.join(result), strict=False, parse_constant=_to_none)
+
+
+def eval_js_object(text, path):
+    """
+    Return ``path`` (e.g. 'data' or 'router.ssrModel') of a JavaScript
+    object literal. Falls back to dukpy if the literal can't be parsed
+    with parse_js_object.
+    """
+    try:
+        value = parse_js_object(text)
+    except ValueError:
+        logger.debug("Can't parse JS object literal, falling back to dukpy")
+        return dukpy.evaljs(f'init={text};init.{path};')
+
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _to_none(constant):
+    return None
+
+
+def _to_json_string(token):
+    if '\\' not in token:
+        if token[0] == '"':
+            return token
+        if '"' not in token:
+            return '"' + token[1:-1] + '"'
+    return json.dumps(_unescape_js_string(token[1:-1]), ensure_ascii=False)
+
+
+def _unescape_js_string(value):
+    if '\\' not in value:
+        return value
+    return _JS_ESCAPE_RE.sub(_unescape_js_char, value)
+
+
+def _unescape_js_char(match):
+    escape = match.group(1)
+    if escape[0] == 'u' and len(escape) > 1:
+        if escape[1] == '{':
+            return chr(int(escape[2:-1], 16))
+        return chr(int(escape[1:], 16))
+    if escape[0] == 'x' and len(escape) == 3:
+        return chr(int(escape[1:], 16))
+    return _JS_ESCAPES.get(escape, escape)
@@ -6,17 +6,26 @@
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
 import codecs
+import json
 import logging
+import os
+import time
 from functools import partial
 from urllib.parse import urlsplit
 
-from scrapy import signals
+from scrapy import Request, signals
 from scrapy.exceptions import CloseSpider, NotConfigured
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.httpobj import urlparse_cached
 from scrapy.utils.misc import load_object
 from scrapy.utils.url import add_http_if_no_scheme
 from twisted.internet import task
 
 from .expire import Proxies, exp_backoff_full_jitter
+from .prober import ProxyProber
+from .selection import UniformSelection
+from .urls import DEFAULT_RULES, UrlCanonicalizer
+from .utils import write_atomic
 
 logger = logging.getLogger(__name__)
 
@@ -131,7 +140,8 @@ class RotatingProxyMiddleware(object):
     Proxy is considered dead if request.meta['_ban'] is True, and alive
     if request.meta['_ban'] is False; to set this meta key use
     BanDetectionMiddleware.
-    Dead proxies are re-checked with a randomized exponential backoff.
+    Dead proxies are re-checked with a randomized exponential backoff;
+    a timer fires when the earliest dead proxy is due for a re-check.
     By default, all default Scrapy concurrency options (DOWNLOAD_DELAY,
     AUTHTHROTTLE_..., CONCURRENT_REQUESTS_PER_DOMAIN, etc) become per-proxy
     for proxied requests when RotatingProxyMiddleware is enabled.
@@ -140,6 +150,20 @@ class RotatingProxyMiddleware(object):
     Settings:
     * ``ROTATING_PROXY_LIST``  - a list of proxies to choose from;
     * ``ROTATING_PROXY_LIST_PATH``  - path to a file with a list of proxies;
+    * ``ROTATING_PROXY_LIST_RELOAD_INTERVAL`` - how often the file from
+      ``ROTATING_PROXY_LIST_PATH`` is checked for changes, in seconds.
+      New proxies are added as unchecked, removed ones are forgotten and
+      the rest keep their state. Default: 60, 0 disables reloading.
+    * ``ROTATING_PROXY_PROBE_URL`` - when set, unchecked and reanimated
+      proxies are checked in background with requests to this URL, and
+      real requests are sent only through good proxies while there are
+      any. Disabled by default.
+    * ``ROTATING_PROXY_PROBE_CONCURRENCY`` - max number of probe requests
+      in flight. Default: 10.
+    * ``ROTATING_PROXY_PROBE_INTERVAL`` - how often new probes are started,
+      in seconds. Default: 10.
+    * ``ROTATING_PROXY_PROBE_TIMEOUT`` - probe request timeout, in seconds.
+      Default: 10.
     * ``ROTATING_PROXY_LOGSTATS_INTERVAL`` - stats logging interval in seconds,
       30 by default;
     * ``ROTATING_PROXY_CLOSE_SPIDER`` - When True, spider is stopped if
@@ -154,29 +178,89 @@ class RotatingProxyMiddleware(object):
       Default is 300 (i.e. 5 min).
     * ``ROTATING_PROXY_BACKOFF_CAP`` - backoff time cap, in seconds.
       Default is 3600 (i.e. 60 min).
+    * ``ROTATING_PROXY_SELECTION`` - path to a proxy selection strategy
+      class with a ``choose(proxies)`` method. Default is
+      'wildsearch_crawler.selection.UniformSelection'; use
+      'wildsearch_crawler.selection.PowerOfTwoChoicesSelection' to prefer
+      fast proxies with a high success rate.
+    * ``ROTATING_PROXY_EWMA_ALPHA`` - smoothing factor of per-proxy latency
+      and success rate moving averages. Default: 0.3.
+    * ``ROTATING_PROXY_STATE_PATH`` - path to a file where proxies health
+      is saved when the engine stops and loaded when it starts, so that
+      the next crawl doesn't re-check known dead proxies. Disabled
+      by default.
+    * ``ROTATING_PROXY_STATE_SAVE_INTERVAL`` - how often proxies health is
+      saved during the crawl, in seconds. Default: 300.
+    * ``ROTATING_PROXY_SHARED_BACKEND`` - path to a backend class which
+      shares proxies health with other crawler processes, e.g.
+      'wildsearch_crawler.backends.SQLiteProxyStateBackend'.
+      Disabled by default.
+    * ``ROTATING_PROXY_SHARED_SYNC_INTERVAL`` - how often changes are
+      exchanged with the shared backend, in seconds. Default: 5.
+    * ``ROTATING_PROXY_PER_HOST`` - when True, proxies health and download
+      slots are tracked per (proxy, website host) pair, so a proxy banned
+      on one website keeps working for other websites. Default: False.
     """
     def __init__(self, proxy_list, logstats_interval, stop_if_no_proxies,
-                 max_proxies_to_try, backoff_base, backoff_cap, crawler):
-
-        backoff = partial(exp_backoff_full_jitter, base=backoff_base, cap=backoff_cap)
-        self.proxies = Proxies(self.cleanup_proxy_list(proxy_list),
-                               backoff=backoff)
+                 max_proxies_to_try, backoff_base, backoff_cap, crawler,
+                 selection=None, ewma_alpha=0.3, state_path=None,
+                 state_save_interval=300, shared_backend=None,
+                 shared_sync_interval=5, per_host=False, proxy_path=None,
+                 reload_interval=60, probe_url=None, probe_concurrency=10,
+                 probe_interval=10, probe_timeout=10):
+
+        self.proxy_list = self.cleanup_proxy_list(proxy_list)
+        self.backoff = partial(exp_backoff_full_jitter, base=backoff_base, cap=backoff_cap)
+        self.ewma_alpha = ewma_alpha
+        self.per_host = per_host
+        # Proxies instances by website host, or a single instance
+        # under '' key if proxies are not tracked per host
+        self.pools = {}
+        if selection is None:
+            selection = UniformSelection()
+        self.selection = selection
         self.logstats_interval = logstats_interval
-        self.reanimate_interval = 5
+        # timer is never scheduled sooner than this, so that proxies
+        # which become due at about the same time are reanimated together
+        self.reanimate_min_delay = 1
         self.stop_if_no_proxies = stop_if_no_proxies
         self.max_proxies_to_try = max_proxies_to_try
+        self.crawler = crawler
         self.stats = crawler.stats
 
+        self.state_path = state_path
+        self.state_save_interval = state_save_interval
+        self.shared_backend = shared_backend
+        self.shared_sync_interval = shared_sync_interval
+
+        self.proxy_path = proxy_path
+        self.reload_interval = reload_interval
+        self.proxy_list_mtime = None
+        if proxy_path is not None:
+            self.proxy_list_mtime = os.path.getmtime(proxy_path)
+
+        self.prober = None
+        if probe_url:
+            self.prober = ProxyProber(self, self.probe_download, probe_url,
+                                      concurrency=probe_concurrency,
+                                      interval=probe_interval,
+                                      timeout=probe_timeout)
+
+        if not self.per_host:
+            self.get_pool('')
+
         self.log_task = None
-        self.reanimate_task = None
+        self.reload_task = None
+        self.reanimate_call = None
+        self.save_state_task = None
+        self.sync_task = None
 
     @classmethod
     def from_crawler(cls, crawler):
         s = crawler.settings
         proxy_path = s.get('ROTATING_PROXY_LIST_PATH', None)
         if proxy_path is not None:
-            with codecs.open(proxy_path, 'r', encoding='utf8') as f:
-                proxy_list = [line.strip() for line in f if line.strip()]
+            proxy_list = cls.read_proxy_list(proxy_path)
         else:
             proxy_list_string = s.get('ROTATING_PROXY_LIST')
 
@@ -191,6 +275,19 @@ class RotatingProxyMiddleware(object):
             backoff_base=s.getfloat('ROTATING_PROXY_BACKOFF_BASE', 300),
             backoff_cap=s.getfloat('ROTATING_PROXY_BACKOFF_CAP', 3600),
             crawler=crawler,
+            selection=cls._load_selection(crawler),
+            ewma_alpha=s.getfloat('ROTATING_PROXY_EWMA_ALPHA', 0.3),
+            state_path=s.get('ROTATING_PROXY_STATE_PATH', None),
+            state_save_interval=s.getfloat('ROTATING_PROXY_STATE_SAVE_INTERVAL', 300),
+            shared_backend=cls._load_shared_backend(crawler),
+            shared_sync_interval=s.getfloat('ROTATING_PROXY_SHARED_SYNC_INTERVAL', 5),
+            per_host=s.getbool('ROTATING_PROXY_PER_HOST', False),
+            proxy_path=proxy_path,
+            reload_interval=s.getfloat('ROTATING_PROXY_LIST_RELOAD_INTERVAL', 60),
+            probe_url=s.get('ROTATING_PROXY_PROBE_URL', None),
+            probe_concurrency=s.getint('ROTATING_PROXY_PROBE_CONCURRENCY', 10),
+            probe_interval=s.getfloat('ROTATING_PROXY_PROBE_INTERVAL', 10),
+            probe_timeout=s.getfloat('ROTATING_PROXY_PROBE_TIMEOUT', 10),
         )
         crawler.signals.connect(mw.engine_started,
                                 signal=signals.engine_started)
@@ -198,78 +295,290 @@ class RotatingProxyMiddleware(object):
                                 signal=signals.engine_stopped)
         return mw
 
+    @classmethod
+    def _load_selection(cls, crawler):
+        selection_path = crawler.settings.get(
+            'ROTATING_PROXY_SELECTION',
+            'wildsearch_crawler.selection.UniformSelection'
+        )
+        selection_cls = load_object(selection_path)
+        if hasattr(selection_cls, 'from_crawler'):
+            return selection_cls.from_crawler(crawler)
+        else:
+            return selection_cls()
+
+    @classmethod
+    def _load_shared_backend(cls, crawler):
+        backend_path = crawler.settings.get('ROTATING_PROXY_SHARED_BACKEND',
+                                            None)
+        if not backend_path:
+            return None
+        backend_cls = load_object(backend_path)
+        if hasattr(backend_cls, 'from_crawler'):
+            return backend_cls.from_crawler(crawler)
+        else:
+            return backend_cls()
+
+    def get_pool(self, host):
+        """ Return Proxies instance which tracks proxies for a website host """
+        if not self.per_host:
+            host = ''
+        pool = self.pools.get(host)
+        if pool is None:
+            # with the prober, real requests go through unchecked
+            # proxies only while none of them is known to be good
+            pool = Proxies(self.proxy_list, backoff=self.backoff,
+                           ewma_alpha=self.ewma_alpha,
+                           prefer_good=self.prober is not None)
+            self.pools[host] = pool
+        return pool
+
+    def get_request_host(self, request):
+        if not self.per_host:
+            return ''
+        return urlparse_cached(request).hostname or ''
+
     def engine_started(self):
+        if self.state_path:
+            self.load_state()
+            if self.state_save_interval:
+                self.save_state_task = task.LoopingCall(self.save_state)
+                self.save_state_task.start(self.state_save_interval, now=False)
+
+        if self.proxy_path is not None and self.reload_interval:
+            self.reload_task = task.LoopingCall(self.reload_proxy_list)
+            self.reload_task.start(self.reload_interval, now=False)
+
+        if self.shared_backend is not None:
+            self.sync_task = task.LoopingCall(self.sync_shared_state)
+            self.sync_task.start(self.shared_sync_interval, now=True)
+
         if self.logstats_interval:
             self.log_task = task.LoopingCall(self.log_stats)
             self.log_task.start(self.logstats_interval, now=True)
 
-        if self.reanimate_interval:
-            self.reanimate_task = task.LoopingCall(self.reanimate_proxies)
-            self.reanimate_task.start(self.reanimate_interval, now=False)
+        if self.prober is not None:
+            self.prober.start()
+
+        self.schedule_reanimation()
+
+    def probe_download(self, request):
+        engine = self.crawler.engine
+        if hasattr(engine, 'download_async'):
+            # Scrapy 2.14+, where download() has no spider argument
+            return deferred_from_coro(engine.download_async(request))
+        return engine.download(request, engine.spider)
+
+    def reload_proxy_list(self):
+        """
+        Apply changes of ``ROTATING_PROXY_LIST_PATH`` file to all proxy
+        pools in place.
+        """
+        try:
+            mtime = os.path.getmtime(self.proxy_path)
+        except OSError:
+            logger.warning("Proxy list %s is not available", self.proxy_path)
+            return
+        if mtime == self.proxy_list_mtime:
+            return
+
+        proxy_list = self.cleanup_proxy_list(self.read_proxy_list(self.proxy_path))
+        if not proxy_list:
+            # most likely the file is being rewritten right now
+            logger.warning("Proxy list %s is empty, keeping old proxies",
+                           self.proxy_path)
+            return
+        self.proxy_list_mtime = mtime
+
+        new_proxies = set(proxy_list)
+        old_proxies = set(self.proxy_list)
+        added = new_proxies - old_proxies
+        removed = old_proxies - new_proxies
+        self.proxy_list = proxy_list
+        for pool in self.pools.values():
+            pool.add_proxies(added)
+            pool.remove_proxies(removed)
+
+        logger.info("Proxy list reloaded: %s added, %s removed",
+                    len(added), len(removed))
+        self.stats.inc_value('proxies/reload/added', len(added))
+        self.stats.inc_value('proxies/reload/removed', len(removed))
+
+    def sync_shared_state(self):
+        """
+        Publish proxies which changed their state since the last sync
+        and apply changes made by other processes.
+        """
+        self.shared_backend.push({host: pool.pop_changed()
+                                  for host, pool in self.pools.items()})
+        rows = self.shared_backend.pull()
+        if rows:
+            n_updated = sum(self.get_pool(host).load_state(host_rows)
+                            for host, host_rows in rows.items())
+            logger.debug("%s proxies updated from the shared state",
+                         n_updated)
+            self.stats.inc_value('proxies/shared_updates', n_updated)
+            self.schedule_reanimation()
+
+    def schedule_reanimation(self):
+        """
+        Make sure the reanimation timer fires not later than the next
+        dead proxy is due for a re-check.
+        """
+        next_checks = [pool.next_reanimation_time
+                       for pool in self.pools.values()]
+        next_checks = [t for t in next_checks if t is not None]
+        if not next_checks:
+            return
+        next_check = min(next_checks)
+
+        # imported here so that loading this module doesn't install a reactor
+        from twisted.internet import reactor
+
+        delay = max(next_check - time.time(), self.reanimate_min_delay)
+        if self.reanimate_call is not None and self.reanimate_call.active():
+            if self.reanimate_call.getTime() <= reactor.seconds() + delay:
+                return
+            self.reanimate_call.cancel()
+
+        self.reanimate_call = reactor.callLater(delay, self.reanimate_proxies)
 
     def reanimate_proxies(self):
-        n_reanimated = self.proxies.reanimate()
+        self.reanimate_call = None
+        n_reanimated = sum(pool.reanimate() for pool in self.pools.values())
         if n_reanimated:
             logger.debug("%s proxies moved from 'dead' to 'reanimated'",
                          n_reanimated)
+        self.schedule_reanimation()
 
     def engine_stopped(self):
         if self.log_task and self.log_task.running:
             self.log_task.stop()
 
-        if self.reanimate_task and self.reanimate_task.running:
-            self.reanimate_task.stop()
+        if self.reload_task and self.reload_task.running:
+            self.reload_task.stop()
+
+        if self.prober is not None:
+            self.prober.stop()
+
+        if self.reanimate_call is not None and self.reanimate_call.active():
+            self.reanimate_call.cancel()
+        self.reanimate_call = None
+
+        if self.save_state_task and self.save_state_task.running:
+            self.save_state_task.stop()
+
+        if self.sync_task and self.sync_task.running:
+            self.sync_task.stop()
+
+        if self.shared_backend is not None:
+            self.shared_backend.push({host: pool.pop_changed()
+                                      for host, pool in self.pools.items()})
+            self.shared_backend.close()
+
+        if self.state_path:
+            self.save_state()
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf8') as f:
+                data = json.load(f)
+        except ValueError:
+            logger.warning("Proxies state file %s is corrupted, ignoring it",
+                           self.state_path)
+            return
+        n_loaded = sum(self.get_pool(host).load_state(rows)
+                       for host, rows in data.items())
+        logger.info("Loaded state of %s proxies from %s", n_loaded,
+                    self.state_path)
+
+    def save_state(self):
+        data = {host: pool.dump_state()
+                for host, pool in self.pools.items()}
+        write_atomic(self.state_path, json.dumps(data, separators=(',', ':')))
 
     def process_request(self, request, spider):
         if 'proxy' in request.meta and not request.meta.get('_rotating_proxy'):
             return
-        proxy = self.proxies.get_random()
+        host = self.get_request_host(request)
+        proxies = self.get_pool(host)
+        proxy = self.selection.choose(proxies)
         if not proxy:
             if self.stop_if_no_proxies:
                 raise CloseSpider("no_proxies")
             else:
                 logger.warn("No proxies available; marking all proxies "
                             "as unchecked")
-                self.proxies.reset()
-                proxy = self.proxies.get_random()
+                proxies.reset()
+                proxy = self.selection.choose(proxies)
                 if proxy is None:
                     logger.error("No proxies available even after a reset.")
                     raise CloseSpider("no_proxies_after_reset")
 
         request.meta['proxy'] = proxy
-        request.meta['download_slot'] = self.get_proxy_slot(proxy)
+        request.meta['download_slot'] = self.get_proxy_slot(proxy, host)
         request.meta['_rotating_proxy'] = True
+        # HttpProxyMiddleware may rewrite meta['proxy'] (e.g. strip
+        # credentials), so remember the exact proxy name for the response
+        # path instead of parsing meta['proxy'] again
+        request.meta['_rotating_proxy_name'] = proxy
 
-    def get_proxy_slot(self, proxy):
+    def get_proxy_slot(self, proxy, host=''):
         """
         Return downloader slot for a proxy.
         By default it doesn't take port in account, i.e. all proxies with
         the same hostname / ip address share the same slot.
+        With ``ROTATING_PROXY_PER_HOST`` website host is a part of the slot.
         """
-        # FIXME: an option to use website address as a part of slot as well?
-        return urlsplit(proxy).hostname
+        slot = urlsplit(proxy).hostname
+        if host:
+            slot = '%s|%s' % (slot, host)
+        return slot
 
     def process_exception(self, request, exception, spider):
         return self._handle_result(request, spider)
 
     def process_response(self, request, response, spider):
-        return self._handle_result(request, spider) or response
+        latency = request.meta.get('download_latency', None)
+        return self._handle_result(request, spider, latency) or response
 
-    def _handle_result(self, request, spider):
-        proxy = self.proxies.get_proxy(request.meta.get('proxy', None))
-        if not (proxy and request.meta.get('_rotating_proxy')):
+    def _handle_result(self, request, spider, latency=None):
+        if not request.meta.get('_rotating_proxy'):
+            return
+        proxies = self.get_pool(self.get_request_host(request))
+        proxy = request.meta.get('_rotating_proxy_name', None)
+        if proxy not in proxies.proxies:
+            # proxy was removed from the list or the request was sent
+            # before the name was stored in meta
+            proxy = proxies.get_proxy(request.meta.get('proxy', None))
+        if not proxy:
             return
-        self.stats.set_value('proxies/unchecked', len(self.proxies.unchecked) - len(self.proxies.reanimated))
-        self.stats.set_value('proxies/reanimated', len(self.proxies.reanimated))
-        self.stats.set_value('proxies/mean_backoff', self.proxies.mean_backoff_time)
         ban = request.meta.get('_ban', None)
+        if ban is not None:
+            proxies.record_result(proxy, not ban, latency)
+        self._update_stats()
         if ban is True:
-            self.proxies.mark_dead(proxy)
-            self.stats.set_value('proxies/dead', len(self.proxies.dead))
+            proxies.mark_dead(proxy)
+            self.schedule_reanimation()
+            self.stats.set_value('proxies/dead', sum(len(p.dead) for p in self.pools.values()))
             return self._retry(request, spider)
         elif ban is False:
-            self.proxies.mark_good(proxy)
-            self.stats.set_value('proxies/good', len(self.proxies.good))
+            proxies.mark_good(proxy)
+            self.stats.set_value('proxies/good', sum(len(p.good) for p in self.pools.values()))
+
+    def _update_stats(self):
+        n_unchecked = n_reanimated = n_dead = 0
+        total_backoff = 0.0
+        for pool in self.pools.values():
+            n_unchecked += len(pool.unchecked)
+            n_reanimated += pool.n_reanimated
+            n_dead += len(pool.dead)
+            total_backoff += pool.mean_backoff_time * len(pool.dead)
+        self.stats.set_value('proxies/unchecked', n_unchecked - n_reanimated)
+        self.stats.set_value('proxies/reanimated', n_reanimated)
+        self.stats.set_value('proxies/mean_backoff', total_backoff / n_dead if n_dead else 0.0)
 
     def _retry(self, request, spider):
         retries = request.meta.get('proxy_retry_times', 0) + 1
@@ -294,7 +603,16 @@ class RotatingProxyMiddleware(object):
                          extra={'spider': spider})
 
     def log_stats(self):
-        logger.info('%s' % self.proxies)
+        for host, pool in self.pools.items():
+            if host:
+                logger.info('%s: %s' % (host, pool))
+            else:
+                logger.info('%s' % pool)
+
+    @classmethod
+    def read_proxy_list(cls, proxy_path):
+        with codecs.open(proxy_path, 'r', encoding='utf8') as f:
+            return [line.strip() for line in f if line.strip()]
 
     @classmethod
     def cleanup_proxy_list(cls, proxy_list):
@@ -385,4 +703,177 @@ class BanDetectionMiddleware(object):
             ex_class = "%s.%s" % (exception.__class__.__module__,
                                   exception.__class__.__name__)
             self.stats.inc_value("bans/error/%s" % ex_class)
-        request.meta['_ban'] = ban
\ No newline at end of file
+        request.meta['_ban'] = ban
+
+
+class AdaptiveConcurrencyMiddleware(object):
+    """
+    Downloader middleware which adjusts concurrency and download delay of
+    each download slot by the ban rate, using the AIMD rule: while the
+    share of bans in a window of responses stays under the target,
+    concurrency grows by one; when it's exceeded, concurrency is cut by
+    ``ADAPTIVE_CONCURRENCY_DECREASE_FACTOR``. A slot with a delay sends
+    at most one request per delay whatever its concurrency is, so the
+    delay is used only below concurrency 1: it grows when concurrency is
+    already 1 and still gets bans, and shrinks back to
+    ``ADAPTIVE_CONCURRENCY_MIN_DELAY`` before concurrency grows again.
+    Start spiders with DOWNLOAD_DELAY of 0 (or small), so that
+    concurrency controls the rate.
+    Bans are read from request.meta['_ban'], so it must run after
+    BanDetectionMiddleware and before RotatingProxyMiddleware retries
+    banned requests::
+        DOWNLOADER_MIDDLEWARES = {
+            # ...
+            'wildsearch_crawler.middlewares.RotatingProxyMiddleware': 610,
+            'wildsearch_crawler.middlewares.AdaptiveConcurrencyMiddleware': 615,
+            'wildsearch_crawler.middlewares.BanDetectionMiddleware': 620,
+            # ...
+        }
+    Unlike AutoThrottle, it reacts to bans rather than to latency, so
+    don't enable both.
+    Settings:
+    * ``ADAPTIVE_CONCURRENCY_ENABLED`` - Default: False.
+    * ``ADAPTIVE_CONCURRENCY_TARGET_BAN_RATE`` - Default: 0.05.
+    * ``ADAPTIVE_CONCURRENCY_WINDOW`` - number of responses per slot
+      between adjustments. Default: 20.
+    * ``ADAPTIVE_CONCURRENCY_MAX`` - max concurrency per slot. Default: 32.
+    * ``ADAPTIVE_CONCURRENCY_DECREASE_FACTOR`` - Default: 0.5.
+    * ``ADAPTIVE_CONCURRENCY_MIN_DELAY`` - Default: 0.
+    * ``ADAPTIVE_CONCURRENCY_MAX_DELAY`` - Default: 60.
+    Concurrency and delay each slot settles on are in
+    ``adaptive_concurrency/<slot>/concurrency`` and
+    ``adaptive_concurrency/<slot>/delay`` stats.
+    """
+    def __init__(self, crawler, target_ban_rate, window, max_concurrency,
+                 decrease_factor, min_delay, max_delay):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.target_ban_rate = target_ban_rate
+        self.window = window
+        self.max_concurrency = max_concurrency
+        self.decrease_factor = decrease_factor
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        # slot key -> [responses, bans] in the current window
+        self.counters = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        if not s.getbool('ADAPTIVE_CONCURRENCY_ENABLED', False):
+            raise NotConfigured()
+        return cls(
+            crawler=crawler,
+            target_ban_rate=s.getfloat('ADAPTIVE_CONCURRENCY_TARGET_BAN_RATE', 0.05),
+            window=s.getint('ADAPTIVE_CONCURRENCY_WINDOW', 20),
+            max_concurrency=s.getint('ADAPTIVE_CONCURRENCY_MAX', 32),
+            decrease_factor=s.getfloat('ADAPTIVE_CONCURRENCY_DECREASE_FACTOR', 0.5),
+            min_delay=s.getfloat('ADAPTIVE_CONCURRENCY_MIN_DELAY', 0),
+            max_delay=s.getfloat('ADAPTIVE_CONCURRENCY_MAX_DELAY', 60),
+        )
+
+    def process_response(self, request, response, spider):
+        self._handle_result(request)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self._handle_result(request)
+
+    def _handle_result(self, request):
+        if request.meta.get('_rotating_proxy_probe'):
+            # probes of ProxyProber check proxies, not the slot
+            return
+        ban = request.meta.get('_ban', None)
+        key = request.meta.get('download_slot', None)
+        if ban is None or key is None:
+            return
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters[key] = [0, 0]
+        counter[0] += 1
+        if ban:
+            counter[1] += 1
+        if counter[0] < self.window:
+            return
+
+        ban_rate = float(counter[1]) / counter[0]
+        counter[0] = counter[1] = 0
+        if ban_rate <= self.target_ban_rate:
+            if slot.delay > self.min_delay:
+                slot.delay = max(slot.delay / 2, self.min_delay)
+                if slot.delay < 0.01:
+                    slot.delay = self.min_delay
+            else:
+                slot.concurrency = min(slot.concurrency + 1, self.max_concurrency)
+        elif slot.concurrency > 1:
+            slot.concurrency = max(int(slot.concurrency * self.decrease_factor), 1)
+        else:
+            slot.delay = min(max(slot.delay * 2, 1.0), self.max_delay)
+
+        self.stats.set_value('adaptive_concurrency/%s/concurrency' % key,
+                             slot.concurrency)
+        self.stats.set_value('adaptive_concurrency/%s/delay' % key,
+                             slot.delay)
+
+
+class CanonicalUrlMiddleware(object):
+    """
+    Spider middleware which rewrites URLs of requests to their canonical
+    form (see wildsearch_crawler.urls) before they reach the scheduler,
+    so that pages are downloaded once, and the dupefilter sees the same
+    page under the same URL. Every rewritten request is a page which
+    would otherwise be downloaded again after its canonical link is
+    found; they are counted in ``canonical_url/refetch_avoided`` stat.
+    Settings:
+    * ``CANONICAL_URL_ENABLED`` - Default: True.
+    * ``CANONICAL_URL_RULES`` - {domain: function path} dict, merged into
+      the default rules; None value disables a default rule.
+    """
+    def __init__(self, canonicalizer, stats):
+        self.canonicalizer = canonicalizer
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        if not s.getbool('CANONICAL_URL_ENABLED', True):
+            raise NotConfigured()
+        rules = dict(DEFAULT_RULES)
+        for domain, rule in s.getdict('CANONICAL_URL_RULES').items():
+            if rule is None:
+                rules.pop(domain, None)
+            else:
+                rules[domain] = load_object(rule)
+        return cls(UrlCanonicalizer(rules), crawler.stats)
+
+    def process_spider_output(self, response, result, spider):
+        for r in result:
+            yield self._canonicalize(r)
+
+    async def process_spider_output_async(self, response, result, spider):
+        # used instead of process_spider_output by Scrapy versions which
+        # support asynchronous spider output
+        async for r in result:
+            yield self._canonicalize(r)
+
+    async def process_start(self, start):
+        async for r in start:
+            yield self._canonicalize(r)
+
+    def process_start_requests(self, start_requests, spider):
+        # used instead of process_start by Scrapy versions before 2.13
+        for r in start_requests:
+            yield self._canonicalize(r)
+
+    def _canonicalize(self, r):
+        if not isinstance(r, Request):
+            return r
+        url = self.canonicalizer.canonicalize(r.url)
+        if url == r.url:
+            return r
+        self.stats.inc_value('canonical_url/refetch_avoided')
+        return r.replace(url=url)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import functools
+import importlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import defer
+
+try:
+    from scrapy.utils.defer import maybe_deferred_to_future
+except ImportError:
+    # Scrapy < 2.6 runs coroutine callbacks with Deferreds only
+    def maybe_deferred_to_future(d):
+        return d
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def cpu_bound(func):
+    """
+    Mark a module-level function as a CPU-heavy extraction step.
+    Calling the decorated function returns an awaitable: a Deferred, or an
+    asyncio Future when the asyncio reactor is installed. If ProcessPool
+    extension is enabled, the function runs in a worker process, so the
+    reactor thread keeps downloading; otherwise it runs in place.
+    Arguments and results must be picklable, so pass ``response.text``
+    rather than responses or selectors. Use it from ``async def``
+    callbacks::
+        @cpu_bound
+        def extract_metadata(text, base_url):
+            return extruct.extract(text, base_url=base_url)
+
+        async def parse(self, response):
+            metadata = await extract_metadata(response.text, response.url)
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _executor is None:
+            d = defer.maybeDeferred(func, *args, **kwargs)
+        else:
+            d = run_in_process(_call_cpu_bound, func.__module__,
+                               func.__qualname__, args, kwargs)
+        return maybe_deferred_to_future(d)
+    return wrapper
+
+
+def run_in_process(func, *args):
+    """ Run ``func(*args)`` in the process pool, return a Deferred """
+    # importing the reactor installs the default one, so spiders which
+    # import this module must not do it before Scrapy picks the reactor
+    from twisted.internet import reactor
+
+    d = defer.Deferred()
+
+    def done(future):
+        error = future.exception()
+        if error is not None:
+            reactor.callFromThread(d.errback, error)
+        else:
+            reactor.callFromThread(d.callback, future.result())
+
+    _executor.submit(func, *args).add_done_callback(done)
+    return d
+
+
+def _call_cpu_bound(module, qualname, args, kwargs):
+    # the decorated function can't be pickled, so a worker process finds
+    # it by name and calls the original one
+    obj = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj.__wrapped__(*args, **kwargs)
+
+
+class ProcessPool(object):
+    """
+    Extension which starts a process pool for functions marked with
+    ``cpu_bound``.
+    Settings:
+    * ``PROCESS_POOL_ENABLED`` - Default: False.
+    * ``PROCESS_POOL_SIZE`` - number of worker processes. Default is
+      a number of CPUs.
+    """
+    def __init__(self, size):
+        self.size = size
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        if not s.getbool('PROCESS_POOL_ENABLED', False):
+            raise NotConfigured()
+        ext = cls(s.getint('PROCESS_POOL_SIZE', os.cpu_count() or 1))
+        crawler.signals.connect(ext.engine_started,
+                                signal=signals.engine_started)
+        crawler.signals.connect(ext.engine_stopped,
+                                signal=signals.engine_stopped)
+        return ext
+
+    def engine_started(self):
+        global _executor
+        _executor = ProcessPoolExecutor(max_workers=self.size)
+        logger.info("Started process pool with %s workers", self.size)
+
+    def engine_stopped(self):
+        global _executor
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import logging
+import os
+import time
+from array import array
+
+import numpy as np
+
+from .utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# (category code, sku) pairs are packed into one int: code << SKU_BITS | sku
+SKU_BITS = 40
+SKU_MASK = np.uint64((1 << SKU_BITS) - 1)
+
+
+class PositionsStore(object):
+    """
+    Local store of product positions in categories, for -a positions=true
+    mode of wb spider.
+    The last known snapshot is kept in columns: category codes, skus and
+    positions, each an array of machine integers in its own file under
+    ``path``. Category URLs are coded as indexes in ``categories.json``.
+    On ``commit()`` the positions added during the run are compared with
+    the snapshot, only changes are written to ``changes-<time>.csv``
+    and the snapshot is updated. Products are reported as removed only
+    from categories marked with ``complete()``, the ones crawled to the
+    last page; others, and categories which weren't crawled in the run,
+    keep their previous positions.
+    Settings:
+    * ``WB_POSITIONS_PATH`` - Default: 'positions'.
+    """
+    COLUMNS = (('categories', 'I'), ('skus', 'Q'), ('positions', 'I'))
+    DTYPES = {name: np.dtype(typecode) for name, typecode in COLUMNS}
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.category_urls = self._load_json('categories.json', [])
+        self.category_codes = {url: code for code, url in enumerate(self.category_urls)}
+        # positions added during the current run
+        self.categories, self.skus, self.positions = (array(typecode) for _, typecode in self.COLUMNS)
+        # codes of categories crawled to the last page during the current run
+        self.complete_categories = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get('WB_POSITIONS_PATH', 'positions'))
+
+    def get_category_code(self, url):
+        code = self.category_codes.get(url)
+        if code is None:
+            code = self.category_codes[url] = len(self.category_urls)
+            self.category_urls.append(url)
+        return code
+
+    def add(self, category_url, sku, position):
+        self.categories.append(self.get_category_code(category_url))
+        self.skus.append(sku)
+        self.positions.append(position)
+
+    def complete(self, category_url):
+        """ Mark a category as crawled to the last page """
+        self.complete_categories.add(self.get_category_code(category_url))
+
+    def __len__(self):
+        return len(self.positions)
+
+    def load_snapshot(self):
+        """ Return (categories, skus, positions) arrays of the last snapshot """
+        columns = []
+        for name, typecode in self.COLUMNS:
+            column = array(typecode)
+            filename = os.path.join(self.path, name + '.bin')
+            if os.path.exists(filename):
+                with open(filename, 'rb') as f:
+                    column.frombytes(f.read())
+            columns.append(column)
+        return tuple(columns)
+
+    def commit(self, _time=None):
+        """
+        Write changes against the last snapshot and make the current run
+        the new snapshot. Return {'changed': n, 'new': n, 'removed': n}.
+        """
+        now = _time if _time is not None else time.time()
+        old_keys, old_positions = unique_keys(*self.load_snapshot())
+        new_keys, new_positions = unique_keys(self.categories, self.skus, self.positions)
+        complete = np.fromiter(self.complete_categories, dtype=np.uint64, count=len(self.complete_categories))
+
+        changes, counts, removed = diff_positions(old_keys, old_positions, new_keys, new_positions, complete)
+        self._write_changes(changes, now)
+
+        # positions of categories which weren't crawled this time are kept,
+        # removed ones are dropped so they come back as new
+        kept = ~np.isin(old_keys, new_keys, assume_unique=True) & ~removed
+        keys = np.concatenate((old_keys[kept], new_keys))
+        positions = np.concatenate((old_positions[kept], new_positions))
+        order = np.argsort(keys, kind='stable')
+        keys, positions = keys[order], positions[order]
+        self._write_snapshot(
+            (keys >> SKU_BITS).astype(self.DTYPES['categories']),
+            keys & SKU_MASK,
+            positions.astype(self.DTYPES['positions']),
+        )
+        self._write_json('categories.json', self.category_urls)
+
+        self.categories, self.skus, self.positions = (array(typecode) for _, typecode in self.COLUMNS)
+        self.complete_categories = set()
+        return counts
+
+    def _write_changes(self, changes, now):
+        keys, old_positions, new_positions = changes
+        if not len(keys):
+            return
+        filename = os.path.join(self.path, 'changes-%s.csv' % time.strftime('%Y%m%d%H%M%S', time.localtime(now)))
+        with open(filename, 'w', encoding='utf8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('wb_category_url', 'wb_id', 'old_position', 'wb_category_position'))
+            # new and removed positions have an empty old or new position
+            writer.writerows(
+                (self.category_urls[category], sku, old_position or '', new_position or '')
+                for category, sku, old_position, new_position in zip(
+                    (keys >> SKU_BITS).tolist(), (keys & SKU_MASK).tolist(),
+                    old_positions.tolist(), new_positions.tolist(),
+                )
+            )
+
+    def _write_snapshot(self, *columns):
+        for (name, _), column in zip(self.COLUMNS, columns):
+            write_atomic(os.path.join(self.path, name + '.bin'), column.tobytes())
+
+    def _load_json(self, name, default):
+        filename = os.path.join(self.path, name)
+        if not os.path.exists(filename):
+            return default
+        with open(filename, encoding='utf8') as f:
+            return json.load(f)
+
+    def _write_json(self, name, data):
+        write_atomic(os.path.join(self.path, name), json.dumps(data, ensure_ascii=False))
+
+
+def pack_keys(categories, skus):
+    """ Pack columns of category codes and skus into a numpy array of keys """
+    categories = np.frombuffer(categories, dtype=PositionsStore.DTYPES['categories']).astype(np.uint64)
+    skus = np.frombuffer(skus, dtype=PositionsStore.DTYPES['skus'])
+    return categories << SKU_BITS | skus
+
+
+def unique_keys(categories, skus, positions):
+    """
+    Return sorted unique keys of the columns and their positions. If a
+    product was seen twice in a category, the last position wins.
+    """
+    keys = pack_keys(categories, skus)[::-1]
+    positions = np.frombuffer(positions, dtype=PositionsStore.DTYPES['positions'])[::-1]
+    keys, index = np.unique(keys, return_index=True)
+    return keys, positions[index].astype(np.int64)
+
+
+def diff_positions(old_keys, old_positions, new_keys, new_positions, categories):
+    """
+    Compare two snapshots given as sorted unique keys and their positions.
+    Only keys of ``categories`` (codes of categories crawled to the last
+    page in the new snapshot) can be removed.
+    Return changes as (keys, old positions, new positions) arrays sorted
+    by key, with 0 for new and removed positions, counts of changes and a
+    mask of ``old_keys`` which were removed.
+    """
+    in_new = np.isin(old_keys, new_keys, assume_unique=True)
+    in_old = np.isin(new_keys, old_keys, assume_unique=True)
+    removed = ~in_new & np.isin(old_keys >> SKU_BITS, categories)
+
+    # keys are sorted, so common keys line up in both snapshots
+    common_old, common_new = old_positions[in_new], new_positions[in_old]
+    changed = common_old != common_new
+    added = ~in_old
+
+    keys = np.concatenate((new_keys[in_old][changed], new_keys[added], old_keys[removed]))
+    old = np.concatenate((common_old[changed], np.zeros(added.sum(), dtype=np.int64), old_positions[removed]))
+    new = np.concatenate((common_new[changed], new_positions[added], np.zeros(removed.sum(), dtype=np.int64)))
+    order = np.argsort(keys, kind='stable')
+
+    counts = {'changed': int(changed.sum()), 'new': int(added.sum()), 'removed': int(removed.sum())}
+    return (keys[order], old[order], new[order]), counts, removed
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+from scrapy.pqueues import ScrapyPriorityQueue
+
+from .utils import write_atomic
+
+
+class CheckpointPriorityQueue(ScrapyPriorityQueue):
+    """
+    Priority queue which writes priorities of its disk queues to
+    ``priorities.json`` as soon as a queue of a new priority is created.
+    The scheduler lists active queues in active.json only on close, so
+    after a crash the queues are found by this file instead. With
+    wildsearch_crawler.squeues queues, which write every request to disk
+    right away, a crashed crawl resumes with all scheduled requests.
+    """
+    PRIORITIES_FILE = 'priorities.json'
+
+    @classmethod
+    def from_crawler(cls, crawler, downstream_queue_cls, key, startprios=(), **kwargs):
+        if key:
+            startprios = sorted(set(startprios) | set(cls.read_priorities(key)))
+        return cls(crawler, downstream_queue_cls, key, startprios, **kwargs)
+
+    def __init__(self, crawler, downstream_queue_cls, key, startprios=(), **kwargs):
+        # memory queues have no key
+        self.priorities = set(startprios) if key else None
+        super().__init__(crawler, downstream_queue_cls, key, startprios, **kwargs)
+
+    def push(self, request):
+        super().push(request)
+        if self.priorities is not None:
+            priority = self.priority(request)
+            if priority not in self.priorities:
+                self.priorities.add(priority)
+                self.write_priorities()
+
+    @classmethod
+    def read_priorities(cls, key):
+        path = os.path.join(key, cls.PRIORITIES_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding='utf8') as f:
+            return json.load(f)
+
+    def write_priorities(self):
+        path = os.path.join(self.key, self.PRIORITIES_FILE)
+        write_atomic(path, json.dumps(sorted(self.priorities)))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import itertools
+import logging
+
+import scrapy
+from twisted.internet import defer, task
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyProber(object):
+    """
+    Background health checker for RotatingProxyMiddleware.
+    It sends cheap requests to ``probe_url`` through unchecked (including
+    reanimated) proxies and marks them good or dead. Pools of the middleware
+    are created with ``prefer_good``, so real requests go through unchecked
+    proxies only while no proxy is known to be good.
+    At most ``concurrency`` probes are in flight at the same time.
+    ``download`` is a function which takes a scrapy.Request and returns
+    a Deferred firing with a response; the middleware passes
+    ``engine.download``, tests can pass anything talking to a local server.
+    """
+    NOT_BAN_STATUSES = {200, 301, 302}
+
+    def __init__(self, middleware, download, probe_url, concurrency=10,
+                 interval=10, timeout=10):
+        self.middleware = middleware
+        self.download = download
+        self.probe_url = probe_url
+        self.concurrency = concurrency
+        self.interval = interval
+        self.timeout = timeout
+        self.in_progress = set()
+        self.task = None
+
+    def start(self):
+        self.task = task.LoopingCall(self.probe_batch)
+        self.task.start(self.interval, now=True)
+
+    def stop(self):
+        if self.task and self.task.running:
+            self.task.stop()
+
+    def probe_batch(self):
+        """ Start probes for unchecked proxies, up to the concurrency limit """
+        free = self.concurrency - len(self.in_progress)
+        if free <= 0:
+            return
+
+        request = scrapy.Request(self.probe_url)
+        host = self.middleware.get_request_host(request)
+        pool = self.middleware.get_pool(host)
+        candidates = list(itertools.islice(
+            (p for p in pool.unchecked if p not in self.in_progress), free
+        ))
+        for proxy in candidates:
+            self.probe(proxy, pool, host)
+
+    def probe(self, proxy, pool, host):
+        request = scrapy.Request(self.probe_url, dont_filter=True, meta={
+            'proxy': proxy,
+            'download_slot': self.middleware.get_proxy_slot(proxy, host),
+            'download_timeout': self.timeout,
+            'dont_retry': True,
+            '_rotating_proxy_probe': True,
+        })
+        self.in_progress.add(proxy)
+
+        d = defer.maybeDeferred(self.download, request)
+        d.addCallbacks(self._on_response, self._on_failure,
+                       callbackArgs=(request, proxy, pool),
+                       errbackArgs=(proxy, pool))
+        d.addBoth(self._on_done, proxy)
+        return d
+
+    def _on_response(self, response, request, proxy, pool):
+        ban = request.meta.get('_ban', None)
+        if ban is None:
+            ban = response.status not in self.NOT_BAN_STATUSES
+        if ban:
+            self._mark_dead(proxy, pool)
+        else:
+            pool.mark_good(proxy)
+            self.middleware.stats.inc_value('proxies/probe/good')
+
+    def _on_failure(self, failure, proxy, pool):
+        logger.debug("Probe through <%s> failed: %s", proxy,
+                     failure.getErrorMessage())
+        self._mark_dead(proxy, pool)
+
+    def _mark_dead(self, proxy, pool):
+        pool.mark_dead(proxy)
+        self.middleware.schedule_reanimation()
+        self.middleware.stats.inc_value('proxies/probe/dead')
+
+    def _on_done(self, _, proxy):
+        self.in_progress.discard(proxy)
+        if self.task and self.task.running:
+            self.probe_batch()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import random
+
+
+class UniformSelection(object):
+    """ Default proxy selection: a random available proxy. """
+
+    def choose(self, proxies):
+        return proxies.get_random()
+
+
+class PowerOfTwoChoicesSelection(object):
+    """
+    Pick two random available proxies and return the one with the better
+    expected throughput, i.e. success rate divided by download latency.
+    Both are moving averages kept in ProxyState by Proxies.record_result.
+    Proxies without latency data get ``DEFAULT_LATENCY``, so new proxies
+    still receive traffic.
+    """
+    DEFAULT_LATENCY = 1.0
+    MIN_LATENCY = 0.01
+
+    def choose(self, proxies):
+        available = proxies.available
+        if not available:
+            return None
+
+        first = random.choice(available)
+        second = random.choice(available)
+        if self.score(proxies.proxies[second]) > self.score(proxies.proxies[first]):
+            return second
+        return first
+
+    def score(self, state):
+        latency = state.latency
+        if latency is None:
+            latency = self.DEFAULT_LATENCY
+        return state.success_rate / max(latency, self.MIN_LATENCY)
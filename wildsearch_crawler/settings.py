@@ -46,22 +46,77 @@ ROBOTSTXT_OBEY = False
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
+SPIDER_MIDDLEWARES = {
 #    'wildsearch_crawler.middlewares.WildsearchCrawlerSpiderMiddleware': 543,
+    'wildsearch_crawler.middlewares.CanonicalUrlMiddleware': 550,
+}
+
+# Extra canonical URL rules, see wildsearch_crawler.urls
+#CANONICAL_URL_RULES = {
+#    'example.com': 'myproject.urls.canonicalize_example',
 #}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
 #    'wildsearch_crawler.middlewares.RotatingProxyMiddleware': 610,
+    'wildsearch_crawler.middlewares.AdaptiveConcurrencyMiddleware': 615,
     'wildsearch_crawler.middlewares.BanDetectionMiddleware': 620,
 }
 
+# Adjust per-slot concurrency by ban rate (see AdaptiveConcurrencyMiddleware)
+#ADAPTIVE_CONCURRENCY_ENABLED = True
+#ADAPTIVE_CONCURRENCY_TARGET_BAN_RATE = 0.05
+#ADAPTIVE_CONCURRENCY_MAX = 32
+
+# Detect captcha and stub pages served with HTTP 200
+#ROTATING_PROXY_BAN_POLICY = 'wildsearch_crawler.policy.ContentBanDetectionPolicy'
+#ROTATING_PROXY_BAN_MARKERS = {
+#    'wildberries.ru': {'captcha': r'captcha'},
+#    'ozon.ru': {'captcha': r'captcha'},
+#}
+#ROTATING_PROXY_BAN_SCAN_BYTES = 4096
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+    'wildsearch_crawler.offload.ProcessPool': 500,
+    'wildsearch_crawler.checkpoint.Checkpoint': 510,
+}
+
+# Run CPU-heavy extraction steps (see wildsearch_crawler.offload) in
+# worker processes
+#PROCESS_POOL_ENABLED = True
+#PROCESS_POOL_SIZE = 4
+
+# Cache first review dates of products between runs, so that reviews
+# pages are not requested again (see wildsearch_crawler.cache)
+#FIRST_REVIEW_CACHE_ENABLED = True
+#FIRST_REVIEW_CACHE_PATH = 'first_review_dates.sqlite'
+#FIRST_REVIEW_CACHE_EMPTY_TTL = 86400
+
+# Filter duplicate product pages by marketplace product id, see
+# wildsearch_crawler.dupefilters
+DUPEFILTER_CLASS = 'wildsearch_crawler.dupefilters.MarketplaceIdDupeFilter'
+#DUPEFILTER_BLOOM_CAPACITY = 10000000
+#DUPEFILTER_BLOOM_ERROR_RATE = 0.001
+
+# Crawls started with -s JOBDIR=... save their state there periodically
+# and can be resumed after a crash, see wildsearch_crawler.checkpoint
+SCHEDULER_PRIORITY_QUEUE = 'wildsearch_crawler.pqueues.CheckpointPriorityQueue'
+SCHEDULER_DISK_QUEUE = 'wildsearch_crawler.squeues.PickleLifoSQLiteQueue'
+SCHEDULER_START_DISK_QUEUE = 'wildsearch_crawler.squeues.PickleFifoSQLiteQueue'
+#CHECKPOINT_INTERVAL = 300
+
+# Remember wb categories and their catalog API queries between runs, see
+# wildsearch_crawler.categories
+#WB_CATEGORY_INDEX_ENABLED = True
+#WB_CATEGORY_INDEX_PATH = 'wb_categories.sqlite'
+#WB_CATEGORY_INDEX_TTL = 86400
+
+# Positions store of wb spider with -a positions=true
+#WB_POSITIONS_PATH = 'positions'
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -8,20 +8,27 @@ import scrapy
 from scrapy.loader import ItemLoader
 
 from wildsearch_crawler.items import WildsearchCrawlerItemOzon
+from wildsearch_crawler.offload import cpu_bound
 
 from .base_spider import BaseSpider
 
 logger = logging.getLogger(__name__)
 
 
+@cpu_bound
+def extract_page_metadata(text, base_url):
+    return extruct.extract(text, base_url=base_url, uniform=True)
+
+
 class WildberriesSpider(BaseSpider):
     name = "ozon"
 
     custom_settings = {
         'USER_AGENT': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_2) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.0.4 Safari/605.1.15',
-        'AUTOTHROTTLE_ENABLED': True,
-        'AUTOTHROTTLE_START_DELAY':  5.0,
-        'AUTOTHROTTLE_TARGET_CONCURRENCY': 1.0
+        # AdaptiveConcurrencyMiddleware adds a delay when concurrency 1 gets banned
+        'DOWNLOAD_DELAY': 0,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 1,
+        'ADAPTIVE_CONCURRENCY_ENABLED': True
     }
 
     def convert_category_url_to_api(self, url):
@@ -127,7 +134,7 @@ class WildberriesSpider(BaseSpider):
                 }
             )
 
-    def parse_good_page(self, response):
+    async def parse_good_page(self, response):
         def find_json_ld_by_type(page_metadata, block_type):
             """Is there a better way to write this?"""
             for block in page_metadata['json-ld']:
@@ -137,7 +144,7 @@ class WildberriesSpider(BaseSpider):
         current_good_item = WildsearchCrawlerItemOzon()
         loader = ItemLoader(item=current_good_item, response=response)
 
-        page_metadata = extruct.extract(response.text, base_url=response.url, uniform=True)
+        page_metadata = await extract_page_metadata(response.text, response.url)
 
         product_meta = find_json_ld_by_type(page_metadata, 'Product')
 
@@ -158,4 +165,4 @@ class WildberriesSpider(BaseSpider):
         loader.add_value('ozon_first_review_date', None)
         loader.add_value('ozon_last_review_date', None)
 
-        yield loader.load_item()
+        return [loader.load_item()]
@@ -1,19 +1,37 @@
 import datetime
 import logging
 import re
-from urllib.parse import urljoin, urlparse
 
 import geopy.distance
 import scrapy
 from scrapy.loader import ItemLoader
 
 from wildsearch_crawler.items import WildsearchCrawlerItemProductcenterProducer
+from wildsearch_crawler.offload import cpu_bound
+from wildsearch_crawler.urls import add_netloc_to_url, canonicalize_url, clear_url_params
 
 from .base_spider import BaseSpider
 
 logger = logging.getLogger(__name__)
 
 
+def prepare_coords(coords_str):
+    coords_str = coords_str.replace(' ', '')
+    return map(float, coords_str.split(','))
+
+
+@cpu_bound
+def extract_producer_coords(text, coords_office=None):
+    """ Return producer coordinates and a distance to the office in km """
+    coords_producer = re.compile('coordinates: \[(\d+\.\d+, \d+\.\d+)]').search(text)[1]
+
+    if coords_office is None:
+        return coords_producer, None
+
+    distance = geopy.distance.vincenty(prepare_coords(coords_office), prepare_coords(coords_producer)).km
+    return coords_producer, round(distance, 2)
+
+
 class ProductcenterProducersSpider(BaseSpider):
     name = "productcenter_producers"
 
@@ -43,13 +61,8 @@ class ProductcenterProducersSpider(BaseSpider):
                 url = url.replace('/producers', '/producers/' + region_filter)
             return url
 
-        def add_domain_to_url(url):
-            start_url_parsed = urlparse(response.request.url)
-            url_parsed = urlparse(url)
-            return urljoin(start_url_parsed.scheme + '://' + start_url_parsed.netloc, url_parsed.path)
-
         for menu_item in response.css('.hcm_producers li ul li'):
-            category_url = add_domain_to_url(add_region_to_url(menu_item.css('a:nth-of-type(1)::attr(href)').get()))
+            category_url = clear_url_params(add_netloc_to_url(add_region_to_url(menu_item.css('a:nth-of-type(1)::attr(href)').get()), response.url))
             category_name = menu_item.css('a:nth-of-type(1)::text').get()
 
             yield response.follow(category_url, callback=self.parse_category, meta={
@@ -58,9 +71,6 @@ class ProductcenterProducersSpider(BaseSpider):
             })
 
     def parse_category(self, response):
-        def clear_url_params(url):
-            return url.split('?')[0]
-
         category_url = response.meta['category_url'] if 'category_url' in response.meta else clear_url_params(response.url)
         category_name = response.meta['category_name'] if 'category_name' in response.meta else response.css('h1::text').get()
 
@@ -78,10 +88,7 @@ class ProductcenterProducersSpider(BaseSpider):
                     'category_name': category_name
                 })
 
-    def parse_producer(self, response):
-        def clear_url_params(url):
-            return url.split('?')[0]
-
+    async def parse_producer(self, response):
         def get_address():
             return str(' ').join((
                 response.css('span[itemprop="addressRegion"]::text').get(),
@@ -89,15 +96,6 @@ class ProductcenterProducersSpider(BaseSpider):
                 response.css('span[itemprop="streetAddress"]::text').get()
             ))
 
-        def add_domain_to_url(url):
-            start_url_parsed = urlparse(response.request.url)
-            url_parsed = urlparse(url)
-            return urljoin(start_url_parsed.scheme + '://' + start_url_parsed.netloc, url_parsed.path)
-
-        def prepare_coords(coords_str):
-            coords_str = coords_str.replace(' ', '')
-            return map(float, coords_str.split(','))
-
         current_producer_item = WildsearchCrawlerItemProductcenterProducer()
 
         loader = ItemLoader(item=current_producer_item, response=response)
@@ -108,9 +106,11 @@ class ProductcenterProducersSpider(BaseSpider):
 
         canonical_url = response.css('link[rel=canonical]::attr(href)').get()
 
-        if canonical_url != response.url:
-            yield response.follow(clear_url_params(canonical_url), self.parse_producer)
-            return
+        # CanonicalUrlMiddleware usually requests the canonical URL in the first place
+        if canonical_url is not None and canonicalize_url(add_netloc_to_url(canonical_url, response.url)) != canonicalize_url(response.url):
+            self.crawler.stats.inc_value('canonical_url/refetch')
+
+            return [response.follow(clear_url_params(canonical_url), self.parse_producer)]
 
         # fill css selectors fields
         loader.add_css('producer_name', 'h1.cfix::text')
@@ -123,27 +123,24 @@ class ProductcenterProducersSpider(BaseSpider):
         loader.add_value('category_url', category_url)
         loader.add_value('category_name', category_name)
         loader.add_value('parse_date', datetime.datetime.now().isoformat(" "))
-        loader.add_value('producer_url', response.url)
+        loader.add_value('producer_url', canonicalize_url(response.url))
         loader.add_value('producer_address', get_address())
-        loader.add_value('producer_logo', add_domain_to_url(response.css('a.fancybox[data-fancybox-group="producer"]::attr(href)').get()))
+        loader.add_value('producer_logo', clear_url_params(add_netloc_to_url(response.css('a.fancybox[data-fancybox-group="producer"]::attr(href)').get(), response.url)))
         loader.add_value('producer_goods_count', producer_goods_count)
         loader.add_value('producer_rating', '')
 
         producer_price_lists = []
 
         for price_list_url in (response.css('#box_files a')):
-            producer_price_lists.append(add_domain_to_url(price_list_url.attrib['href']))
+            producer_price_lists.append(clear_url_params(add_netloc_to_url(price_list_url.attrib['href'], response.url)))
 
         loader.add_value('producer_price_lists', producer_price_lists)
 
-        coords_producer = re.compile('coordinates: \[(\d+\.\d+, \d+\.\d+)]').search(response.text)[1]
-        loader.add_value('producer_coords', coords_producer)
-
         coords_office = getattr(self, 'office_coords', None)
+        coords_producer, producer_distance = await extract_producer_coords(response.text, coords_office)
+        loader.add_value('producer_coords', coords_producer)
 
-        if coords_office is not None:
-            coords_office = prepare_coords(coords_office)
-            coords_producer = prepare_coords(coords_producer)
-            loader.add_value('producer_distance', round(geopy.distance.vincenty(coords_office, coords_producer).km, 2))
+        if producer_distance is not None:
+            loader.add_value('producer_distance', producer_distance)
 
-        yield loader.load_item()
+        return [loader.load_item()]
@@ -3,6 +3,10 @@ import logging
 from urllib.parse import urljoin, urlparse
 
 import scrapy
+from scrapy.exceptions import NotConfigured
+
+from wildsearch_crawler.categories import CategoryIndex
+from wildsearch_crawler.urls import clear_url_params
 
 from .base_spider import BaseSpider
 
@@ -12,10 +16,35 @@ logger = logging.getLogger(__name__)
 class WildberriesCategoriesSpider(BaseSpider):
     name = "wb_categories"
 
+    category_index = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+
+        try:
+            spider.category_index = CategoryIndex.from_crawler(crawler)
+        except NotConfigured:
+            pass
+
+        return spider
+
+    def closed(self, reason):
+        if self.category_index is not None:
+            self.category_index.close()
+
+        super().closed(reason)
+
     def start_requests(self):
         yield scrapy.Request('https://www.wildberries.ru/menu/getrendered?lang=ru&burger=true', self.parse_main_menu, headers={'x-requested-with': 'XMLHttpRequest'})
 
     def parse_main_menu(self, response):
+        # share the list of categories with wb spider runs
+        if self.category_index is not None:
+            self.category_index.set_listed([
+                (clear_url_params(response.urljoin(url.attrib['href'])), url.css('::text').get()) for url in response.css('a[href]')
+            ])
+
         # start_url_parsed = urlparse(response.request.url)
 
         for url in response.css('a'):
@@ -3,10 +3,11 @@ import logging
 import math
 import re
 
-import dukpy
 import scrapy
 from scrapy.exceptions import CloseSpider
 
+from wildsearch_crawler.jsobject import eval_js_object
+
 from .base_spider import BaseSpider
 
 logger = logging.getLogger(__name__)
@@ -55,10 +56,9 @@ class WildberriesCommentsSpider(BaseSpider):
         products_init = re.findall(r'wb\.spa\.init\(({.*?})\);', products_data_js)[0]
 
         if products_init is not None and str(products_init) != '':
-            interpreter = dukpy.JSInterpreter()
-            evaled_data = interpreter.evaljs(f'init={products_init};init.router;')
+            evaled_data = eval_js_object(products_init, 'router')
 
-            if 'ssrModel' in evaled_data.keys():
+            if evaled_data is not None and 'ssrModel' in evaled_data.keys():
                 imt_id = evaled_data['ssrModel']['product']['imtId']
                 feedbacks_count = evaled_data['ssrModel']['product']['feedbacks']
 
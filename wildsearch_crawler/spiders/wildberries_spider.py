@@ -3,28 +3,169 @@ import json
 import logging
 import math
 import re
-from urllib.parse import urlparse
+from urllib.parse import quote, urlparse
 
-import dukpy
 import scrapy
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
 from scrapy.loader import ItemLoader
 
+from wildsearch_crawler.cache import FirstReviewDateCache
+from wildsearch_crawler.categories import CategoryIndex
+from wildsearch_crawler.fingerprints import CatalogFingerprints
 from wildsearch_crawler.items import WildsearchCrawlerItemWildberries
+from wildsearch_crawler.jsobject import eval_js_object
+from wildsearch_crawler.positions import PositionsStore
+from wildsearch_crawler.offload import cpu_bound
+from wildsearch_crawler.urls import add_netloc_to_url, canonicalize_url, clear_url_params
 
 from .base_spider import BaseSpider
 
 logger = logging.getLogger(__name__)
 
 
+def format_kopecks(kopecks):
+    """ Format a price in kopecks as roubles, without losing digits """
+    if kopecks % 100 == 0:
+        return '%d' % (kopecks // 100)
+    return '%d.%02d' % divmod(kopecks, 100)
+
+
+@cpu_bound
+def parse_purchases_count_v1(products_data_js, wb_id):
+    products_data_js = re.sub('\n', '', products_data_js)
+    products_data_js = re.sub(r'\s{2,}', '', products_data_js)
+
+    products_init = re.findall(r'wb\.product\.DomReady\.init\(({.*?})\);', products_data_js)[0]
+
+    if products_init is not None and str(products_init) != '':
+        evaled_data = eval_js_object(products_init, 'data')
+
+        if evaled_data is not None and 'nomenclatures' in evaled_data.keys():
+            for sku_id, data in evaled_data['nomenclatures'].items():
+                if sku_id == wb_id:
+                    return data['ordersCount']
+
+
+@cpu_bound
+def parse_purchases_count_v2(products_data_js, wb_id):
+    products_data_js = re.sub('\n', '', products_data_js)
+    products_data_js = re.sub(r'\s{2,}', '', products_data_js)
+
+    products_data_js = re.sub('routes: routes,', '', products_data_js)
+    products_data_js = re.sub('routesDictionary: routesDictionary,', '', products_data_js)
+
+    products_init = re.findall(r'wb\.spa\.init\(({.*?})\);', products_data_js)[0]
+
+    if products_init is not None and str(products_init) != '':
+        evaled_data = eval_js_object(products_init, 'router')
+
+        if evaled_data is not None and 'ssrModel' in evaled_data.keys():
+            ssrModel = evaled_data['ssrModel']
+
+            if 'selectedNomenclature' in ssrModel.keys():
+                selectedNomenclature = ssrModel['selectedNomenclature']
+
+                if 'ordersCount' in selectedNomenclature:
+                    return selectedNomenclature['ordersCount']
+
+
 class WildberriesSpider(BaseSpider):
     name = "wb"
 
+    # card API returns details of many products at once, see -a detail_api=true
+    DETAIL_API_URL = 'https://wbxcatalog-ru.wildberries.ru/nm-2-card/list?nm='
+    DETAIL_API_BATCH_SIZE = 100
+
+    # with -a json_walk=true catalog pages are requested this many at a time
+    # until the first empty one
+    CATEGORY_API_URL = 'https://wbxcatalog-ru.wildberries.ru/nm-2-card/catalog?'
+    CATEGORY_WALK_WINDOW = 3
+    CATEGORY_PAGE_SIZE = 100
+    # failed pages in a row after which a chain of the walk is given up
+    CATEGORY_WALK_MAX_FAILURES = 3
+
+    # -a search_query_file=... resolves each query to a catalog query of its
+    # shard, then walks its pages one by one, at most SEARCH_MAX_PAGES
+    SEARCH_API_URL = 'https://wbxsearch.wildberries.ru/exactmatch/v2/common?query='
+    SEARCH_CATALOG_URL = 'https://wbxcatalog-ru.wildberries.ru/'
+    SEARCH_MAX_PAGES = 10
+
+    first_review_cache = None
+    category_index = None
+    catalog_fingerprints = None
+    positions_store = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+
+        try:
+            spider.first_review_cache = FirstReviewDateCache.from_crawler(crawler)
+        except NotConfigured:
+            pass
+
+        try:
+            spider.category_index = CategoryIndex.from_crawler(crawler)
+        except NotConfigured:
+            pass
+
+        if getattr(spider, 'incremental', False):
+            spider.catalog_fingerprints = CatalogFingerprints.from_crawler(crawler)
+            # sku -> fingerprint of changed products, saved once their details are scraped
+            spider.pending_fingerprints = {}
+            crawler.signals.connect(spider.item_scraped, signal=signals.item_scraped)
+
+        if getattr(spider, 'positions', False):
+            spider.positions_store = PositionsStore.from_crawler(crawler)
+            # category url -> pages (or chains of json_walk) left before the
+            # category is crawled to the end, or None once a page failed
+            spider.category_pages_left = {}
+
+        return spider
+
+    def closed(self, reason):
+        if self.first_review_cache is not None:
+            self.first_review_cache.close()
+
+        if self.category_index is not None:
+            self.category_index.close()
+
+        if self.catalog_fingerprints is not None:
+            self.catalog_fingerprints.close()
+
+        if self.positions_store is not None:
+            self.crawler.stats.set_value('positions/rows', len(self.positions_store))
+
+            # positions of an interrupted crawl are partial, they'd show up
+            # as removed products and become the baseline of the next run
+            if reason == 'finished':
+                for name, count in self.positions_store.commit().items():
+                    self.crawler.stats.set_value('positions/' + name, count)
+            else:
+                logger.warning(f'Spider closed with {reason!r}, positions are not saved')
+
+        super().closed(reason)
+
+    def item_scraped(self, item, response, spider):
+        wb_id = str(item.get('wb_id', ''))
+
+        # until then, a product which failed to scrape counts as changed on the next run
+        if wb_id.isdigit() and int(wb_id) in self.pending_fingerprints:
+            self.catalog_fingerprints.store({int(wb_id): self.pending_fingerprints.pop(int(wb_id))})
+
     def start_requests(self):
+        search_query_file = getattr(self, 'search_query_file', None)
+
+        if search_query_file is not None:
+            yield from self.search_requests(search_query_file)
+            return
+
         category_urls = getattr(self, 'category_url', None)
 
         if category_urls is not None:
             for category_url in category_urls.split(','):
-                yield scrapy.Request(category_url, self.parse_category)
+                yield from self.follow_category(category_url)
 
             return
 
@@ -37,6 +178,16 @@ class WildberriesSpider(BaseSpider):
             return
 
         # start crawl from sitemap or main menu
+        if not getattr(self, 'use_sitemap', False) and self.category_index is not None:
+            categories = self.category_index.get_listed()
+
+            if categories:
+                # the menu was seen recently, no need to download it again
+                for category_url, category_name in categories:
+                    yield from self.follow_category(category_url)
+
+                return
+
         if getattr(self, 'use_sitemap', False):
             yield scrapy.Request("https://www.wildberries.ru/services/karta-sayta", self.parse_sitemap)
         else:
@@ -46,42 +197,131 @@ class WildberriesSpider(BaseSpider):
         pass
 
     def parse_main_menu(self, response):
-        for url in response.css('a::attr(href)'):
-            yield response.follow(url, self.parse_category)
+        categories = [(response.urljoin(a.attrib['href']), a.css('::text').get()) for a in response.css('a[href]')]
+
+        if self.category_index is not None:
+            self.category_index.set_listed([(clear_url_params(url), name) for url, name in categories])
+
+        for url, name in categories:
+            yield from self.follow_category(url)
 
     def parse_sitemap(self, response):
         for url in response.css('#sitemap a::attr(href)'):
-            yield response.follow(url, self.parse_category)
+            yield from self.follow_category(response.urljoin(url.get()))
 
-    def parse_category(self, response):
-        def clear_url_params(url):
-            return url.split('?')[0]
+    def follow_category(self, url):
+        """
+        Request a category page, or if the category is found in the category
+        index, go straight to its catalog JSON pages
+        """
+        category = None
 
-        def generate_api_url(response, page):
-            path = response.css('#catalog::attr(data-xcatalog-path)').get()
-            query = response.css('#catalog::attr(data-xcatalog-query)').get()
+        if self.category_index is not None:
+            category = self.category_index.get(clear_url_params(url))
 
-            return 'https://wbxcatalog-ru.wildberries.ru/nm-2-card/catalog?' + query + '&page=' + str(page)
+        if category is not None and category['query']:
+            yield from self.follow_category_pages(clear_url_params(url), category['name'], category['query'], category['total'], category['page_size'])
+        else:
+            yield scrapy.Request(url, self.parse_category)
 
+    def follow_category_pages(self, category_url, category_name, query, total_goods, items_on_page):
+        if getattr(self, 'json_walk', False):
+            # don't trust the total, walk pages until the first empty one
+            self.category_pages_started(category_url, self.get_category_walk_window())
+            yield from self.start_category_walk(category_url, category_name, query, items_on_page)
+            return
+
+        wb_category_position = 0
+        pages = math.ceil(total_goods / items_on_page)
+        self.category_pages_started(category_url, pages)
+
+        for page in range(1, pages + 1):
+            yield scrapy.Request(self.CATEGORY_API_URL + query + '&page=' + str(page), callback=self.parse_category_page_json, errback=self.category_page_errback, meta={
+                'current_position': wb_category_position,
+                'category_url': category_url,
+                'category_name': category_name,
+            })
+
+            wb_category_position += items_on_page
+
+    def start_category_walk(self, category_url, category_name, query, page_size=None):
+        for page in range(1, self.get_category_walk_window() + 1):
+            yield self.category_page_request(category_url, category_name, query, page, page_size)
+
+    def get_category_walk_window(self):
+        return int(getattr(self, 'walk_window', self.CATEGORY_WALK_WINDOW))
+
+    def category_page_request(self, category_url, category_name, query, page, page_size=None, failures=0):
+        page_size = page_size or self.CATEGORY_PAGE_SIZE
+
+        # pages after the first window are requested by the walk itself, once per
+        # walk, so the dupefilter can only break the chain there
+        return scrapy.Request(self.CATEGORY_API_URL + query + '&page=' + str(page), callback=self.parse_category_page_json,
+                              errback=self.category_page_errback, dont_filter=page > self.get_category_walk_window(), meta={
+            'current_position': (page - 1) * page_size,
+            'category_url': category_url,
+            'category_name': category_name,
+            'walk': {'query': query, 'page': page, 'page_size': page_size, 'failures': failures},
+        })
+
+    def category_page_errback(self, failure):
+        yield from self.skip_category_page(failure.request.meta, repr(failure.value))
+
+    def category_pages_started(self, category_url, pages):
+        if self.positions_store is not None:
+            # a category which is already being crawled is requested again only
+            # from the menu, and the dupefilter drops those pages
+            if self.category_pages_left.setdefault(category_url, pages) == 0:
+                self.positions_store.complete(category_url)
+
+    def category_page_done(self, category_url, failed=False):
+        if self.positions_store is None or self.category_pages_left.get(category_url) is None:
+            return
+
+        if failed:
+            self.category_pages_left[category_url] = None
+            return
+
+        self.category_pages_left[category_url] -= 1
+
+        if self.category_pages_left[category_url] <= 0:
+            self.positions_store.complete(category_url)
+
+    def skip_category_page(self, meta, error):
+        """ Skip a failed page of the walk and go on, unless pages keep failing """
+        # products of the page are unknown, so none of the category are removed
+        self.category_page_done(meta['category_url'], failed=True)
+
+        walk = meta.get('walk')
+
+        if walk is None:
+            logger.warning(f'Catalog page of {meta["category_url"]} failed: {error}')
+            self.crawler.stats.inc_value('wb/catalog_page_failed')
+            return
+
+        failures = walk.get('failures', 0) + 1
+
+        if failures >= self.CATEGORY_WALK_MAX_FAILURES:
+            logger.warning(f'Catalog walk of {meta["category_url"]} aborted at page {walk["page"]}: {error}')
+            self.crawler.stats.inc_value('wb/catalog_walk_aborted')
+            return
+
+        self.crawler.stats.inc_value('wb/catalog_walk_failed_pages')
+        yield self.category_page_request(meta['category_url'], meta['category_name'], walk['query'], walk['page'] + self.get_category_walk_window(), walk['page_size'], failures)
+
+    def parse_category(self, response):
         category_url = clear_url_params(response.url)
         category_name = response.css('h1::text').get()
 
         if response.css('#catalog::attr(data-xcatalog-path)').get() is not None:
-            wb_category_position = 0
-
             items_on_page = len(response.css('.j-card-item'))
             total_goods = int(response.css('#catalog::attr(data-xcatalog-total)').get())
+            query = response.css('#catalog::attr(data-xcatalog-query)').get()
 
-            pages = math.ceil(total_goods / items_on_page)
-
-            for page in range(1, pages + 1):
-                yield response.follow(generate_api_url(response, page), callback=self.parse_category_page_json, meta={
-                    'current_position': wb_category_position,
-                    'category_url': category_url,
-                    'category_name': category_name,
-                })
+            if self.category_index is not None:
+                self.category_index.set(category_url, name=category_name, query=query, total=total_goods, page_size=items_on_page)
 
-                wb_category_position += items_on_page
+            yield from self.follow_category_pages(category_url, category_name, query, total_goods, items_on_page)
         else:
             wb_category_position = int(response.meta['current_position']) if 'current_position' in response.meta else 1
 
@@ -131,30 +371,55 @@ class WildberriesSpider(BaseSpider):
 
         skip_details = getattr(self, 'skip_details', False)
         allow_dupes = getattr(self, 'allow_dupes', False)
+        detail_api = getattr(self, 'detail_api', False)
+
+        try:
+            category_data = json.loads(response.text)
+        except ValueError:
+            category_data = None
 
-        category_data = json.loads(response.text)
+        # only a page with data is a real empty page which ends the walk
+        if not isinstance(category_data, dict) or not isinstance(category_data.get('data'), dict):
+            yield from self.skip_category_page(response.meta, f'no catalog data in {response.url}')
+            return
 
         wb_category_position = int(response.meta['current_position']) if 'current_position' in response.meta else 0
         wb_category_url = response.meta['category_url']
         wb_category_name = response.meta['category_name']
 
-        for item in category_data['data']['products']:
+        # sku id -> category position, flushed to card API in batches
+        detail_api_positions = {}
+
+        products = category_data['data'].get('products') or []
+
+        # with -a incremental=true details are requested only for products whose
+        # catalog fields changed since the previous run
+        changed = None
+
+        if self.catalog_fingerprints is not None and not skip_details and self.positions_store is None:
+            fingerprints = {item['id']: CatalogFingerprints.fingerprint(item) for item in products}
+            changed = self.catalog_fingerprints.changed(fingerprints)
+
+            self.pending_fingerprints.update((sku, fingerprints[sku]) for sku in changed)
+            self.crawler.stats.inc_value('incremental/changed', len(changed))
+            self.crawler.stats.inc_value('incremental/unchanged', len(products) - len(changed))
+
+        for item in products:
             wb_category_position += 1
 
-            if skip_details:
-                yield {
-                    'wb_id': item['id'],
-                    'product_name': item['name'],
-                    'wb_reviews_count': item['feedbackCount'],
-                    'wb_price': item['salePrice'],
-                    'parse_date': datetime.datetime.now().isoformat(" "),
-                    'marketplace': 'wildberries',
-                    'product_url': generate_good_url(item['id'], response.url),
-                    'wb_category_url': wb_category_url,
-                    'wb_category_name': wb_category_name,
-                    'wb_category_position': wb_category_position,
-                    'wb_brand_name': item['brand']
-                }
+            # with -a positions=true positions go to the local store instead of items
+            if self.positions_store is not None:
+                self.positions_store.add(wb_category_url, item['id'], wb_category_position)
+            elif changed is not None and item['id'] not in changed:
+                yield self.catalog_item(item, wb_category_url, wb_category_name, wb_category_position)
+            elif detail_api and not skip_details:
+                detail_api_positions[item['id']] = wb_category_position
+
+                if len(detail_api_positions) >= self.get_detail_api_batch_size():
+                    yield self.detail_api_request(detail_api_positions, wb_category_url, wb_category_name)
+                    detail_api_positions = {}
+            elif skip_details:
+                yield self.catalog_item(item, wb_category_url, wb_category_name, wb_category_position)
             else:
                 yield response.follow(generate_good_url(item['id'], response.url), self.parse_good, dont_filter=allow_dupes, meta={
                     'current_position': wb_category_position,
@@ -162,10 +427,237 @@ class WildberriesSpider(BaseSpider):
                     'category_name': wb_category_name
                 })
 
-    def parse_good(self, response):
-        def clear_url_params(url):
-            return url.split('?')[0]
+        if detail_api_positions:
+            yield self.detail_api_request(detail_api_positions, wb_category_url, wb_category_name)
+
+        # keep the window of catalog pages in flight, the first empty page ends the walk
+        walk = response.meta.get('walk')
+
+        if walk is None or not products:
+            self.category_page_done(wb_category_url)
 
+        if walk is not None:
+            if products:
+                yield self.category_page_request(wb_category_url, wb_category_name, walk['query'], walk['page'] + self.get_category_walk_window(), walk['page_size'])
+            else:
+                self.crawler.stats.inc_value('category_walk/empty_pages')
+
+    def search_requests(self, path):
+        """
+        Read queries from ``path``, one per line. A query may be followed by
+        a tab and comma separated SKUs tracked in it, in addition to
+        -a tracked_skus=...
+        """
+        tracked_skus = self.parse_skus(getattr(self, 'tracked_skus', ''))
+
+        # read lazily, Scrapy takes start requests as the downloader frees up,
+        # so only about CONCURRENT_REQUESTS queries are in progress at once
+        with open(path, encoding='utf8') as f:
+            for line in f:
+                query, _, skus = line.rstrip('\n').partition('\t')
+                query = query.strip()
+
+                if query:
+                    yield scrapy.Request(self.SEARCH_API_URL + quote(query), callback=self.parse_search, dont_filter=True, meta={
+                        'search_query': query,
+                        'tracked_skus': tracked_skus | self.parse_skus(skus),
+                    })
+
+    @staticmethod
+    def parse_skus(skus):
+        return {int(sku) for sku in skus.split(',') if sku.strip().isdigit()}
+
+    def get_search_max_pages(self):
+        return int(getattr(self, 'search_max_pages', self.SEARCH_MAX_PAGES))
+
+    def parse_search(self, response):
+        try:
+            search_data = json.loads(response.text)
+        except ValueError:
+            search_data = None
+
+        if not isinstance(search_data, dict):
+            logger.warning(f'No search data in {response.url}')
+            self.crawler.stats.inc_value('search/bad_responses')
+            yield from self.search_not_found(response.meta['search_query'], response.meta['tracked_skus'])
+            return
+
+        if not search_data.get('shardKey') or not search_data.get('query'):
+            self.crawler.stats.inc_value('search/no_results')
+            yield from self.search_not_found(response.meta['search_query'], response.meta['tracked_skus'])
+            return
+
+        yield self.search_page_request(response.meta['search_query'], search_data['shardKey'], search_data['query'], 1, 0, response.meta['tracked_skus'])
+
+    def search_page_request(self, search_query, shard, query, page, position, missing):
+        # pages of started queries go first, so that they finish before new queries start
+        return scrapy.Request(self.SEARCH_CATALOG_URL + shard + '/catalog?' + query + '&page=' + str(page), callback=self.parse_search_page_json, priority=1, dont_filter=True, meta={
+            'search_query': search_query,
+            'search': {'shard': shard, 'query': query, 'page': page, 'position': position},
+            'tracked_skus': missing,
+        })
+
+    def parse_search_page_json(self, response):
+        search_query = response.meta['search_query']
+        search = response.meta['search']
+        tracked_skus = response.meta['tracked_skus']
+        # tracked SKUs which weren't found on previous pages
+        missing = set(tracked_skus)
+
+        try:
+            search_data = json.loads(response.text)
+        except ValueError:
+            search_data = None
+
+        # the walk of the query ends, positions after this page are unknown
+        if not isinstance(search_data, dict) or not isinstance(search_data.get('data'), dict):
+            logger.warning(f'No catalog data in {response.url}')
+            self.crawler.stats.inc_value('search/bad_pages')
+            yield from self.search_not_found(search_query, missing)
+            return
+
+        products = search_data['data'].get('products') or []
+        position = search['position']
+
+        for item in products:
+            position += 1
+
+            if not tracked_skus:
+                yield self.search_item(item, search_query, position)
+            elif item['id'] in missing:
+                missing.discard(item['id'])
+                yield self.search_item(item, search_query, position)
+
+        if tracked_skus and not missing:
+            self.crawler.stats.inc_value('search/stopped_early')
+        elif products and search['page'] < self.get_search_max_pages():
+            yield self.search_page_request(search_query, search['shard'], search['query'], search['page'] + 1, position, missing)
+        else:
+            yield from self.search_not_found(search_query, missing)
+
+        self.crawler.stats.inc_value('search/pages')
+
+    def search_not_found(self, search_query, skus):
+        """ Tracked SKUs which weren't found in the first pages have no position """
+        for sku in sorted(skus):
+            self.crawler.stats.inc_value('search/not_found')
+
+            yield {
+                'wb_id': sku,
+                'parse_date': datetime.datetime.now().isoformat(" "),
+                'marketplace': 'wildberries',
+                'product_url': f'https://www.wildberries.ru/catalog/{sku}/detail.aspx',
+                'search_query': search_query,
+                'search_position': None,
+            }
+
+    def search_item(self, item, search_query, search_position):
+        """ Short item made of a product from search catalog JSON """
+        return {
+            'wb_id': item['id'],
+            'product_name': item['name'],
+            'wb_reviews_count': item['feedbackCount'],
+            'wb_price': item['salePrice'],
+            'parse_date': datetime.datetime.now().isoformat(" "),
+            'marketplace': 'wildberries',
+            'product_url': f'https://www.wildberries.ru/catalog/{item["id"]}/detail.aspx',
+            'search_query': search_query,
+            'search_position': search_position,
+            'wb_brand_name': item['brand']
+        }
+
+    def catalog_item(self, item, wb_category_url, wb_category_name, wb_category_position):
+        """ Short item made of a product from catalog JSON """
+        return {
+            'wb_id': item['id'],
+            'product_name': item['name'],
+            'wb_reviews_count': item['feedbackCount'],
+            'wb_price': item['salePrice'],
+            'parse_date': datetime.datetime.now().isoformat(" "),
+            'marketplace': 'wildberries',
+            'product_url': f'https://www.wildberries.ru/catalog/{item["id"]}/detail.aspx',
+            'wb_category_url': wb_category_url,
+            'wb_category_name': wb_category_name,
+            'wb_category_position': wb_category_position,
+            'wb_brand_name': item['brand']
+        }
+
+    def get_detail_api_batch_size(self):
+        return int(getattr(self, 'detail_api_batch_size', self.DETAIL_API_BATCH_SIZE))
+
+    def detail_api_request(self, positions, category_url, category_name):
+        url = self.DETAIL_API_URL + ';'.join(str(wb_id) for wb_id in positions)
+
+        return scrapy.Request(url, callback=self.parse_detail_api, dont_filter=getattr(self, 'allow_dupes', False), meta={
+            'positions': positions,
+            'category_url': category_url,
+            'category_name': category_name,
+        })
+
+    def parse_detail_api(self, response):
+        positions = response.meta['positions']
+        products = json.loads(response.text)['data']['products']
+
+        for product in products:
+            yield self.load_detail_api_item(product, response.meta, positions.get(product['id']))
+
+        missing = len(positions) - len(products)
+
+        if missing > 0:
+            logger.debug(f'Card API returned {len(products)} of {len(positions)} products')
+            self.crawler.stats.inc_value('detail_api/missing', missing)
+
+    def load_detail_api_item(self, product, meta, position=None):
+        """
+        Fill WildsearchCrawlerItemWildberries from a product of card API
+        response, without downloading the product page.
+        """
+        skip_images = getattr(self, 'skip_images', False)
+
+        loader = ItemLoader(item=WildsearchCrawlerItemWildberries())
+
+        # prices are in kopecks in salePriceU, older responses have salePrice in roubles
+        if 'salePriceU' in product:
+            price = product['salePriceU']
+        elif product.get('salePrice') is not None:
+            price = round(product['salePrice'] * 100)
+        else:
+            price = None
+
+        reviews_count = product.get('feedbacks', product.get('feedbackCount'))
+
+        loader.add_value('wb_id', str(product['id']))
+        loader.add_value('product_name', product.get('name'))
+        loader.add_value('wb_brand_name', product.get('brand'))
+        loader.add_value('parse_date', datetime.datetime.now().isoformat(" "))
+        loader.add_value('marketplace', 'wildberries')
+        loader.add_value('product_url', f'https://www.wildberries.ru/catalog/{product["id"]}/detail.aspx')
+        loader.add_value('wb_category_url', meta.get('category_url'))
+        loader.add_value('wb_category_name', meta.get('category_name'))
+        loader.add_value('wb_category_position', position)
+
+        if price is not None:
+            loader.add_value('wb_price', format_kopecks(price))
+
+        if reviews_count is not None:
+            loader.add_value('wb_reviews_count', str(reviews_count))
+
+        if product.get('rating') is not None:
+            loader.add_value('wb_rating', str(product['rating']))
+
+        if product.get('ordersCount') is not None:
+            loader.add_value('wb_purchases_count', product['ordersCount'])
+
+        if skip_images is False and product.get('pics'):
+            vol = product['id'] // 10000 * 10000
+
+            loader.add_value('image_urls', [
+                f'https://images.wbstatic.net/big/new/{vol}/{product["id"]}-{i}.jpg' for i in range(1, product['pics'] + 1)
+            ])
+
+        return loader.load_item()
+
+    async def parse_good(self, response):
         def generate_reviews_link(base_url, sort='Asc'):
             # at first it is like https://www.wildberries.ru/catalog/8685970/detail.aspx
             # must be like https://www.wildberries.ru/catalog/8685970/otzyvy?field=Date&order=Asc
@@ -173,24 +665,13 @@ class WildberriesSpider(BaseSpider):
 
             return re.sub('detail\.aspx.*$', f'otzyvy?field=Date&order={sort}&link={link_param}', base_url)
 
-        def add_netloc_to_url(url, base_url):
-            url_parsed = urlparse(url)
-
-            if url_parsed.scheme == '' and url_parsed.netloc == '':
-                base_url_parsed = urlparse(base_url)
-
-                url = base_url_parsed.scheme + '://' + base_url_parsed.netloc + url
-
-            return url
-
         skip_images = getattr(self, 'skip_images', False)
         skip_variants = getattr(self, 'skip_variants', False)
         allow_dupes = getattr(self, 'allow_dupes', False)
 
-        current_good_item = WildsearchCrawlerItemWildberries()
-        parent_item = response.meta['parent_item'] if 'parent_item' in response.meta else None
+        parent_id = response.meta['parent_id'] if 'parent_id' in response.meta else None
 
-        loader = ItemLoader(item=current_good_item, response=response)
+        loader = ItemLoader(item=WildsearchCrawlerItemWildberries(), response=response)
 
         # category position stats
         wb_category_url = response.meta['category_url'] if 'category_url' in response.meta else None
@@ -198,15 +679,15 @@ class WildberriesSpider(BaseSpider):
         wb_category_position = response.meta['current_position'] if 'current_position' in response.meta else None
 
         canonical_url = response.css('link[rel=canonical]::attr(href)').get()
-        canonical_url = add_netloc_to_url(canonical_url, response.url)
 
-        if canonical_url != response.url:
-            yield response.follow(clear_url_params(canonical_url), self.parse_good, dont_filter=allow_dupes,  meta={
+        # CanonicalUrlMiddleware usually requests the canonical URL in the first place
+        if canonical_url is not None and canonicalize_url(add_netloc_to_url(canonical_url, response.url)) != canonicalize_url(response.url):
+            self.crawler.stats.inc_value('canonical_url/refetch')
+
+            return [response.follow(clear_url_params(add_netloc_to_url(canonical_url, response.url)), self.parse_good, dont_filter=allow_dupes,  meta={
                 'current_position': wb_category_position,
                 'category_url': wb_category_url
-            })
-
-            return
+            })]
 
         # scraping brand and manufacturer countries
         wb_brand_country = ''
@@ -235,7 +716,7 @@ class WildberriesSpider(BaseSpider):
         loader.add_value('wb_id', wb_id)
         loader.add_value('parse_date', datetime.datetime.now().isoformat(" "))
         loader.add_value('marketplace', 'wildberries')
-        loader.add_value('product_url', response.url)
+        loader.add_value('product_url', canonicalize_url(response.url))
         loader.add_value('wb_brand_name', response.css('.brand-and-name .brand::text').get())
         loader.add_value('wb_brand_url', response.css('.brand-logo a::attr(href)').get())
         loader.add_value('wb_brand_logo', response.css('.brand-logo img::attr(src)').get())
@@ -266,68 +747,65 @@ class WildberriesSpider(BaseSpider):
         products_data_js_v1 = response.xpath('//script[contains(., "wb.product.DomReady.init")]/text()').get()
 
         if products_data_js_v1 is not None and str(products_data_js_v1) != '':
-            loader.add_value('wb_purchases_count', self.parse_purchases_count_v1(products_data_js_v1, wb_id))
+            loader.add_value('wb_purchases_count', await parse_purchases_count_v1(products_data_js_v1, wb_id))
 
         products_data_js_v2 = response.xpath('//script[contains(., "wb.spa.init")]/text()').get()
 
         if products_data_js_v2 is not None and str(products_data_js_v2) != '':
-            loader.add_value('wb_purchases_count', self.parse_purchases_count_v2(products_data_js_v2, wb_id))
-
-        if parent_item is not None:
-            loader.add_value('wb_parent_id', parent_item.get('wb_id', ''))
-
-        # get reviews dates
-        yield response.follow(generate_reviews_link(response.url, 'Asc'), callback=self.parse_good_first_review_date, errback=self.parse_good_errback, meta={'loader': loader}, headers={'x-requested-with': 'XMLHttpRequest'})
-
-        # follow goods variants only if we scrape parent item
-        if skip_variants is False and parent_item is None:
-            for variant in (response.css('.options ul li a::attr(href)')):
-                yield response.follow(clear_url_params(variant.get()), callback=self.parse_good, meta={
-                    'parent_item': current_good_item
-                })
-
-    def parse_purchases_count_v1(self, products_data_js, wb_id):
-        products_data_js = re.sub('\n', '', products_data_js)
-        products_data_js = re.sub(r'\s{2,}', '', products_data_js)
+            loader.add_value('wb_purchases_count', await parse_purchases_count_v2(products_data_js_v2, wb_id))
 
-        products_init = re.findall(r'wb\.product\.DomReady\.init\(({.*?})\);', products_data_js)[0]
+        if parent_id is not None:
+            loader.add_value('wb_parent_id', parent_id)
 
-        if products_init is not None and str(products_init) != '':
-            interpreter = dukpy.JSInterpreter()
-            evaled_data = interpreter.evaljs(f'init={products_init};init.data;')
+        # get reviews dates, reviews are shared by all variants with the same imt id
+        imt_id = None
 
-            if evaled_data is not None and 'nomenclatures' in evaled_data.keys():
-                for sku_id, data in evaled_data['nomenclatures'].items():
-                    if sku_id == wb_id:
-                        return data['ordersCount']
+        for products_data_js in (products_data_js_v1, products_data_js_v2):
+            if imt_id is None and products_data_js is not None:
+                imt_id = re.search(r'imtId["\']?\s*:\s*(\d+)', products_data_js)
+                imt_id = imt_id.group(1) if imt_id is not None else None
 
-    def parse_purchases_count_v2(self, products_data_js, wb_id):
-        products_data_js = re.sub('\n', '', products_data_js)
-        products_data_js = re.sub(r'\s{2,}', '', products_data_js)
+        first_review_cache_keys = [f'imt:{imt_id}' if imt_id else None, f'nm:{wb_id}' if wb_id else None]
 
-        products_data_js = re.sub('routes: routes,', '', products_data_js)
-        products_data_js = re.sub('routesDictionary: routesDictionary,', '', products_data_js)
-
-        products_init = re.findall(r'wb\.spa\.init\(({.*?})\);', products_data_js)[0]
+        if self.first_review_cache is not None:
+            found, first_review_date = self.first_review_cache.get(first_review_cache_keys)
+        else:
+            found, first_review_date = False, None
 
-        if products_init is not None and str(products_init) != '':
-            interpreter = dukpy.JSInterpreter()
-            evaled_data = interpreter.evaljs(f'init={products_init};init.router;')
+        if found:
+            if first_review_date is not None:
+                loader.add_value('wb_first_review_date', first_review_date)
 
-            if 'ssrModel' in evaled_data.keys():
-                ssrModel = evaled_data['ssrModel']
+            results = [loader.load_item()]
+        else:
+            # only plain extracted values go to meta, so that the page and its selectors
+            # are freed while the reviews request waits, and the request can be pickled
+            results = [response.follow(generate_reviews_link(response.url, 'Asc'), callback=self.parse_good_first_review_date, errback=self.parse_good_errback, meta={
+                'good': dict(loader.load_item()),
+                'first_review_cache_keys': first_review_cache_keys
+            }, headers={'x-requested-with': 'XMLHttpRequest'})]
 
-                if 'selectedNomenclature' in ssrModel.keys():
-                    selectedNomenclature = ssrModel['selectedNomenclature']
+        # follow goods variants only if we scrape parent item
+        if skip_variants is False and parent_id is None:
+            for variant in (response.css('.options ul li a::attr(href)')):
+                results.append(response.follow(clear_url_params(variant.get()), callback=self.parse_good, meta={
+                    'parent_id': wb_id
+                }))
 
-                    if 'ordersCount' in selectedNomenclature:
-                        return selectedNomenclature['ordersCount']
+        return results
 
     def parse_good_first_review_date(self, response):
+        good = WildsearchCrawlerItemWildberries(response.meta['good'])
+        first_review_date = None
+
         if len(response.css('.comment')) > 0:
-            response.meta['loader'].add_value('wb_first_review_date', response.css('.comment')[0].css('.time::attr(content)').get())
+            first_review_date = response.css('.comment')[0].css('.time::attr(content)').get()
+            good['wb_first_review_date'] = first_review_date
+
+        if self.first_review_cache is not None and 'first_review_cache_keys' in response.meta:
+            self.first_review_cache.set(response.meta['first_review_cache_keys'], first_review_date)
 
-        yield response.meta['loader'].load_item()
+        yield good
 
-    def parse_good_errback(self, response):
-        yield response.meta['loader'].load_item()
+    def parse_good_errback(self, failure):
+        yield WildsearchCrawlerItemWildberries(failure.request.meta['good'])
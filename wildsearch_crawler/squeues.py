@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+
+from queuelib import queue
+
+try:
+    from scrapy.utils.request import request_from_dict
+except ImportError:
+    # Scrapy < 2.6
+    from scrapy.utils.reqser import request_from_dict, request_to_dict
+else:
+    def request_to_dict(request, spider=None):
+        return request.to_dict(spider=spider)
+
+
+class FifoSQLiteQueue(queue.FifoSQLiteQueue):
+    """
+    queuelib's SQLite queue, which writes every pushed and popped request
+    to the database right away, so that the queue survives a crash,
+    unlike the default disk queues which save their state on close.
+    WAL journal makes those commits cheap, and the length is kept in
+    memory, because the scheduler asks for it all the time and
+    COUNT(*) scans the whole table.
+    """
+    def __init__(self, path):
+        super().__init__(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._size = super().__len__()
+
+    def push(self, item):
+        super().push(item)
+        self._size += 1
+
+    def pop(self):
+        item = super().pop()
+        if item is not None:
+            self._size -= 1
+        return item
+
+    def clear(self):
+        super().clear()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+
+class LifoSQLiteQueue(FifoSQLiteQueue):
+    _sql_pop = queue.LifoSQLiteQueue._sql_pop
+
+
+class PickleFifoSQLiteQueue(object):
+    """
+    Disk queue of requests for ``SCHEDULER_DISK_QUEUE`` and
+    ``SCHEDULER_START_DISK_QUEUE``: requests are turned into dicts,
+    pickled and kept in FifoSQLiteQueue.
+    """
+    queue_class = FifoSQLiteQueue
+
+    def __init__(self, crawler, key):
+        self.crawler = crawler
+        dirname = os.path.dirname(key)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        self.queue = self.queue_class(key)
+
+    @classmethod
+    def from_crawler(cls, crawler, key, *args, **kwargs):
+        return cls(crawler, key)
+
+    def push(self, request):
+        try:
+            data = pickle.dumps(request_to_dict(request, spider=self.crawler.spider), protocol=4)
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            # the scheduler keeps requests which raise ValueError in memory
+            raise ValueError(str(e)) from e
+        self.queue.push(data)
+
+    def pop(self):
+        data = self.queue.pop()
+        if data is None:
+            return None
+        return request_from_dict(pickle.loads(data), spider=self.crawler.spider)
+
+    def close(self):
+        self.queue.close()
+
+    def __len__(self):
+        return len(self.queue)
+
+
+class PickleLifoSQLiteQueue(PickleFifoSQLiteQueue):
+    queue_class = LifoSQLiteQueue
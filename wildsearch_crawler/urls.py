@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import re
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+
+def clear_url_params(url):
+    """ Drop query string and fragment from ``url`` """
+    return url.split('#')[0].split('?')[0]
+
+
+def add_netloc_to_url(url, base_url):
+    """ Make a relative ``url`` found on ``base_url`` page absolute """
+    return urljoin(base_url, url)
+
+
+_WILDBERRIES_GOOD_RE = re.compile(r'^/catalog/(\d+)/detail\.aspx')
+_OZON_GOOD_RE = re.compile(r'^/(context/detail/id|product)/[^/]+/')
+_PRODUCTCENTER_PRODUCER_RE = re.compile(r'^/producers/\d+/')
+
+
+def canonicalize_wildberries(parts):
+    """
+    https://wildberries.ru/catalog/8685970/detail.aspx?targetUrl=GP
+    -> https://www.wildberries.ru/catalog/8685970/detail.aspx
+    """
+    if parts.netloc not in ('wildberries.ru', 'www.wildberries.ru'):
+        return None
+    match = _WILDBERRIES_GOOD_RE.match(parts.path)
+    if match is None:
+        return None
+    return f'https://www.wildberries.ru/catalog/{match.group(1)}/detail.aspx'
+
+
+def canonicalize_ozon(parts):
+    """
+    https://www.ozon.ru/context/detail/id/151480118/?asb=...
+    -> https://www.ozon.ru/context/detail/id/151480118/
+    """
+    match = _OZON_GOOD_RE.match(parts.path)
+    if match is None:
+        return None
+    return urlunsplit(('https', 'www.ozon.ru', match.group(0), '', ''))
+
+
+def canonicalize_productcenter(parts):
+    """
+    https://productcenter.ru/producers/21613/miteus?utm_source=...
+    -> https://productcenter.ru/producers/21613/miteus
+    """
+    if _PRODUCTCENTER_PRODUCER_RE.match(parts.path) is None:
+        return None
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, '', ''))
+
+
+DEFAULT_RULES = {
+    'wildberries.ru': canonicalize_wildberries,
+    'ozon.ru': canonicalize_ozon,
+    'productcenter.ru': canonicalize_productcenter,
+}
+
+
+class UrlCanonicalizer(object):
+    """
+    Rewrites product page URLs to the form websites use in
+    ``link[rel=canonical]``, so that a page is downloaded once under its
+    canonical URL and not once more after the spider sees the canonical
+    link.
+    ``rules`` is a {domain: function} dict; a rule of a domain also
+    applies to its subdomains. A function takes urlsplit() result and
+    returns a canonical URL, or None to keep the URL as is.
+    """
+    def __init__(self, rules=None):
+        self.rules = DEFAULT_RULES if rules is None else rules
+
+    def get_rule(self, host):
+        parts = host.split('.')
+        for i in range(len(parts) - 1):
+            rule = self.rules.get('.'.join(parts[i:]))
+            if rule is not None:
+                return rule
+        return None
+
+    def canonicalize(self, url):
+        parts = urlsplit(url)
+        rule = self.get_rule(parts.hostname or '')
+        if rule is None:
+            return url
+        return rule(parts) or url
+
+
+_default_canonicalizer = UrlCanonicalizer()
+
+
+def canonicalize_url(url):
+    """ Canonicalize ``url`` with the default marketplace rules """
+    return _default_canonicalizer.canonicalize(url)
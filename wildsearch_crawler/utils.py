@@ -1,4 +1,34 @@
+import os
 import re
+import sqlite3
+
+
+def open_sqlite(path):
+    """
+    Open a SQLite database which other processes may use at the same time:
+    autocommit mode, WAL journal and a long busy timeout. The directory
+    of ``path`` is created if it doesn't exist.
+    """
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def write_atomic(path, data):
+    """
+    Write ``data`` (bytes, or str to be encoded as UTF-8) to a temporary
+    file and move it over ``path``, so that a crash during writing
+    doesn't leave a broken file behind.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf8')
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
 
 
 def extract_proxy_hostport(proxy):